@@ -0,0 +1,248 @@
+"""Export a couple's data as a ZIP stream, and import such an archive.
+
+Layout of an archive::
+
+    manifest.json   format version and export time
+    couple.json     the couples row
+    words.jsonl     one message per line, oldest first
+    images.jsonl    one photo per line; "file" names its entry under files/
+    files/...       the stored originals
+
+export_couple() is a generator: zipfile writes into a sink that is emptied
+after every batch of rows or chunk of a file, so the response streams with
+constant memory and no temporary copy. Entry sizes are not known up front;
+zipfile records them in data descriptors, which every unzip tool reads.
+
+import_archive() reads the archive back into an existing couple. Rows are
+inserted in batches of IMPORT_BATCH_SIZE and photos go through
+media.ingest(), so an archive is never trusted for file types or hashes.
+Imported rows get new ids; the couple's emails are left untouched.
+"""
+import io
+import json
+import time
+import zipfile
+import zlib
+from datetime import datetime, timezone
+
+import db
+import media
+import quotas
+
+FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+FILE_CHUNK_SIZE = 1024 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+
+
+class InvalidArchive(ValueError):
+    pass
+
+
+# What reading a damaged entry can raise: a CRC mismatch or an entry shorter
+# than the directory claims (BadZipFile, EOFError), corrupt deflate data
+# (zlib.error), an unsupported compression method (NotImplementedError) or an
+# encrypted entry (RuntimeError).
+ENTRY_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError)
+
+
+class _Sink(io.RawIOBase):
+    # Unseekable, so zipfile streams entries with data descriptors.
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _rows(table, columns, couple_id, max_id):
+    # Keyset batches up to the newest id seen when the export started, so
+    # no read transaction stays open for the whole download.
+    after = 0
+    while True:
+        rows = db.query(
+            f'SELECT id, {columns} FROM {table} WHERE couple_id=? AND id>? AND id<=? ORDER BY id LIMIT ?',
+            (couple_id, after, max_id, EXPORT_BATCH_SIZE)
+        )
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def _entry(name, compress_type=zipfile.ZIP_DEFLATED):
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def export_couple(couple_id, store):
+    """Yield the ZIP archive of one couple's data in chunks."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        couple = db.query_one('SELECT id, user1_email, user2_email, created_at FROM couples WHERE id=?', (couple_id,))
+        max_word_id = db.query_one('SELECT COALESCE(MAX(id), 0) FROM words WHERE couple_id=?', (couple_id,))[0]
+        max_image_id = db.query_one('SELECT COALESCE(MAX(id), 0) FROM images WHERE couple_id=?', (couple_id,))[0]
+        zf.writestr(_entry('manifest.json'), json.dumps({
+            'format': FORMAT_VERSION,
+            'exported_at': datetime.now(timezone.utc).isoformat(),
+        }))
+        zf.writestr(_entry('couple.json'), json.dumps(dict(zip(('id', 'user1_email', 'user2_email', 'created_at'), couple))))
+        yield sink.take()
+
+        with zf.open(_entry('words.jsonl'), 'w', force_zip64=True) as out:
+            for rows in _rows('words', 'text, sender_email, created_at', couple_id, max_word_id):
+                for word_id, text, sender_email, created_at in rows:
+                    out.write(json.dumps({
+                        'id': word_id, 'text': text, 'sender_email': sender_email, 'created_at': created_at,
+                    }).encode() + b'\n')
+                yield sink.take()
+
+        with zf.open(_entry('images.jsonl'), 'w', force_zip64=True) as out:
+            for rows in _rows('images', 'filename, note, created_at', couple_id, max_image_id):
+                for image_id, filename, note, created_at in rows:
+                    present = store.exists(filename)
+                    out.write(json.dumps({
+                        'id': image_id, 'note': note, 'created_at': created_at,
+                        'file': f'files/{filename}' if present else None,
+                    }).encode() + b'\n')
+                yield sink.take()
+
+        # Several rows may share one stored file; it is written once.
+        written = set()
+        for rows in _rows('images', 'filename', couple_id, max_image_id):
+            for _, filename in rows:
+                if filename in written:
+                    continue
+                try:
+                    src = store.open(filename)
+                except FileNotFoundError:
+                    continue
+                written.add(filename)
+                # Photos are already compressed; deflating them again only costs CPU.
+                with src, zf.open(_entry(f'files/{filename}', zipfile.ZIP_STORED), 'w', force_zip64=True) as out:
+                    while True:
+                        chunk = src.read(FILE_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        yield sink.take()
+    yield sink.take()
+
+
+def _jsonl(zf, name):
+    try:
+        f = zf.open(name)
+    except KeyError:
+        return
+    except ENTRY_ERRORS as e:
+        raise InvalidArchive(f'{name} is damaged: {e}') from e
+    with f:
+        while True:
+            try:
+                line = f.readline(MAX_LINE_BYTES + 1)
+            except ENTRY_ERRORS as e:
+                raise InvalidArchive(f'{name} is damaged: {e}') from e
+            if not line:
+                return
+            if len(line) > MAX_LINE_BYTES:
+                raise InvalidArchive(f'{name}: line too long.')
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise InvalidArchive(f'{name}: {e}') from e
+            if not isinstance(item, dict):
+                raise InvalidArchive(f'{name}: expected one JSON object per line.')
+            yield item
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_archive(fileobj, couple_id, store, add_image, max_file_bytes, max_total_bytes):
+    """Load an export_couple() archive into ``couple_id``; returns counts.
+
+    ``fileobj`` must be seekable (an uploaded file is spooled to disk by
+    werkzeug). ``add_image(filename, note, couple_id, content_hash)``
+    stores each photo row, so derivatives are queued and the gallery quota
+    applies as for an upload; photos over the quota are skipped.
+
+    Sizes are checked against the uncompressed sizes in the ZIP directory,
+    which zipfile never reads past: an archive expanding to more than
+    ``max_total_bytes`` is refused before anything is imported, and photos
+    over ``max_file_bytes`` (the upload limit) are skipped unread.
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise InvalidArchive('Not a ZIP archive.') from e
+    with zf:
+        try:
+            manifest = json.loads(zf.read('manifest.json'))
+        except (KeyError, ValueError, *ENTRY_ERRORS) as e:
+            raise InvalidArchive('manifest.json is missing or unreadable.') from e
+        version = manifest.get('format') if isinstance(manifest, dict) else None
+        if version != FORMAT_VERSION:
+            raise InvalidArchive(f'Unsupported archive format {version!r}.')
+        if sum(info.file_size for info in zf.infolist()) > max_total_bytes:
+            raise InvalidArchive('Archive is too large once uncompressed.')
+
+        counts = {'words': 0, 'images': 0, 'skipped_images': 0}
+        for batch in _batches(_jsonl(zf, 'words.jsonl'), IMPORT_BATCH_SIZE):
+            rows = [
+                (couple_id, _text(w['text']), _text(w.get('sender_email')), _text(w.get('created_at')))
+                for w in batch if w.get('text')
+            ]
+            with db.transaction() as conn:
+                conn.executemany(
+                    'INSERT INTO words (couple_id, text, sender_email, created_at) '
+                    'VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                    rows
+                )
+            counts['words'] += len(rows)
+
+        for image in _jsonl(zf, 'images.jsonl'):
+            name = image.get('file')
+            if not isinstance(name, str):
+                counts['skipped_images'] += 1
+                continue
+            try:
+                if zf.getinfo(name).file_size > max_file_bytes:
+                    counts['skipped_images'] += 1
+                    continue
+                with zf.open(name) as src:
+                    filename, content_hash = media.ingest(src, store)
+            except (KeyError, media.InvalidImage, *ENTRY_ERRORS):
+                counts['skipped_images'] += 1
+                continue
+            try:
+                add_image(filename, _text(image.get('note')), couple_id, content_hash)
+            except quotas.QuotaExceeded:
+                counts['skipped_images'] += 1
+                continue
+            counts['images'] += 1
+    return counts
@@ -0,0 +1,185 @@
+"""Self-hosted, bundled and fingerprinted CSS/JS.
+
+    cd backend && flask --app main build-assets
+
+The pinned third-party files listed in VENDOR are committed under
+static/vendor. The build concatenates each entry of BUNDLES from local files
+only and writes <name>.<hash>.<ext> next to pre-compressed .gz and .br copies
+(.br only when the ``brotli`` package is installed) to ASSETS_DIST, which
+defaults to the untracked instance/assets rather than anywhere under static/.
+manifest.json maps bundle names to the fingerprinted files. The app builds
+on start when there is no manifest yet, and fails rather than serve a bundle
+with a source missing.
+``build-assets --download`` fetches VENDOR files that are not there, e.g.
+after a version bump.
+
+Templates link assets with ``asset_url('app.css')``. /assets/ serves the
+smallest variant the browser accepts with a one-year immutable
+Cache-Control: a changed file gets a new name, so a cached one never needs
+revalidating. A reverse proxy can serve ASSETS_DIST directly instead
+(nginx: ``gzip_static on; brotli_static on;``).
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+import requests
+from flask import abort, request, send_from_directory, url_for
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+DIST_ROOT = os.getenv('ASSETS_DIST', os.path.join(BASE_DIR, 'instance', 'assets'))
+MANIFEST = 'manifest.json'
+MAX_AGE = 365 * 24 * 3600
+DOWNLOAD_TIMEOUT = 30
+
+# One version of each library for every page, and where it came from.
+VENDOR = {
+    'vendor/bootstrap-5.3.0.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/popper-2.11.8.min.js': 'https://cdn.jsdelivr.net/npm/@popperjs/core@2.11.8/dist/umd/popper.min.js',
+    'vendor/bootstrap-5.3.0.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.min.js',
+}
+
+# Bundle name -> files under static/, in load order. Popper followed by
+# bootstrap.min.js is what bootstrap.bundle.min.js contains.
+BUNDLES = {
+    'app.css': ['vendor/bootstrap-5.3.0.min.css', 'style.css'],
+    'app.js': ['vendor/popper-2.11.8.min.js', 'vendor/bootstrap-5.3.0.min.js', 'js/reveal.js'],
+}
+
+
+class AssetError(Exception):
+    pass
+
+
+def _write(path, data):
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'wb') as out:
+        out.write(data)
+    os.replace(tmp_path, path)
+
+
+def fetch_vendor(root=STATIC_ROOT, names=None):
+    """Download any missing VENDOR files."""
+    for name in names or VENDOR:
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            continue
+        response = requests.get(VENDOR[name], timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write(path, response.content)
+
+
+def _read_source(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Source maps are not shipped.
+    prefixes = (b'//# sourceMappingURL', b'/*# sourceMappingURL')
+    return b'\n'.join(line for line in data.splitlines() if not line.lstrip().startswith(prefixes))
+
+
+def _compress(path, data):
+    _write(f'{path}.gz', gzip.compress(data, 9, mtime=0))
+    try:
+        import brotli  # optional dependency, browsers fall back to gzip without it
+    except ImportError:
+        return
+    _write(f'{path}.br', brotli.compress(data, quality=11))
+
+
+def load_manifest(dist=DIST_ROOT):
+    try:
+        with open(os.path.join(dist, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def build(root=STATIC_ROOT, dist=DIST_ROOT):
+    """Write every bundle from the files under ``root`` to ``dist`` and return the manifest."""
+    sources = {source for sources in BUNDLES.values() for source in sources}
+    missing = sorted(source for source in sources if not os.path.exists(os.path.join(root, source)))
+    if missing:
+        raise AssetError(f'Missing asset sources: {", ".join(missing)}')
+
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        separator = b';\n' if name.endswith('.js') else b'\n'
+        data = separator.join(_read_source(os.path.join(root, source)) for source in sources)
+        base, ext = os.path.splitext(name)
+        filename = f'{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        path = os.path.join(dist, filename)
+        if not os.path.exists(path):
+            _write(path, data)
+            _compress(path, data)
+        manifest[name] = filename
+
+    # Keep the previous generation so pages rendered before a deploy still load.
+    previous = load_manifest(dist) or {}
+    keep = set(manifest.values()) | set(previous.values())
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    for entry in os.listdir(dist):
+        if entry != MANIFEST and entry.removesuffix('.br').removesuffix('.gz') not in keep:
+            os.remove(os.path.join(dist, entry))
+    return manifest
+
+
+def _sources_changed(root, manifest_mtime):
+    sources = {source for sources in BUNDLES.values() for source in sources}
+    return any(
+        os.path.getmtime(os.path.join(root, source)) > manifest_mtime
+        for source in sources if os.path.exists(os.path.join(root, source))
+    )
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_ROOT', STATIC_ROOT)
+    app.config.setdefault('ASSETS_DIST', DIST_ROOT)
+    root, dist = app.config['ASSETS_ROOT'], app.config['ASSETS_DIST']
+    state = app.extensions['assets'] = {'manifest': load_manifest(dist)}
+    if state['manifest'] is None:
+        state['manifest'] = build(root, dist)
+
+    def asset_url(name):
+        # In debug mode edits to style.css show up on the next page load.
+        if app.debug:
+            manifest_path = os.path.join(dist, MANIFEST)
+            if os.path.exists(manifest_path) and _sources_changed(root, os.path.getmtime(manifest_path)):
+                state['manifest'] = build(root, dist)
+        filename = state['manifest'].get(name)
+        if filename is None:
+            raise AssetError(f'Unknown asset bundle {name!r}')
+        return url_for('assets', filename=filename)
+
+    def serve(filename):
+        if filename == MANIFEST:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[encoding] and os.path.exists(os.path.join(dist, filename + suffix)):
+                response = send_from_directory(dist, filename + suffix, mimetype=mimetype, max_age=MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(dist, filename, mimetype=mimetype, max_age=MAX_AGE)
+        response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve)
+    app.add_template_global(asset_url, 'asset_url')
+
+    @app.cli.command('build-assets')
+    @click.option('--download', is_flag=True, help='Fetch missing VENDOR files first.')
+    def build_assets_command(download):
+        """Write the fingerprinted, compressed bundles."""
+        if download:
+            fetch_vendor(root)
+        state['manifest'] = build(root, dist)
+        for name, filename in sorted(state['manifest'].items()):
+            print(f'{name} -> {os.path.join(dist, filename)}')
@@ -0,0 +1,137 @@
+"""Offline test harness for benchmarks: fake login, fake Replicate, seeded data.
+
+Nothing here talks to Google or Replicate. Virtual user ``i`` is the first
+partner of seeded couple ``i``; its session cookie is minted with the app's
+own SECRET_KEY, and the stub userinfo provider maps its access token back to
+the seeded email, so login_required, homepage and profile behave exactly as
+for a real Google login.
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import db
+import invitations
+import jobs
+from main import create_app
+
+BENCH_SECRET_KEY = 'bench-secret-key'
+SEED_BATCH_SIZE = 10_000
+LOREM = (
+    'miss you already', 'dinner tonight?', 'good morning love', 'look at this photo',
+    'proud of you', 'call me when you land', 'thinking about our trip', 'sweet dreams',
+)
+
+
+def user_email(n):
+    return f'bench-user-{n}@example.com'
+
+
+def partner_email(n):
+    return f'bench-partner-{n}@example.com'
+
+
+def fake_userinfo(token):
+    # Tokens minted by session_cookie() are 'bench-<n>'.
+    n = int(token['access_token'].rsplit('-', 1)[1])
+    return {'email': user_email(n), 'verified_email': True}
+
+
+def seed(couples, words_per_couple=20, images_per_couple=5, seed_value=42):
+    """Fill the configured database with ``couples`` couples and their feeds.
+
+    Couple ids are 1..couples, so virtual user n maps to couple n. Image rows
+    point at placeholder files; the benchmark never fetches them.
+    """
+    rng = random.Random(seed_value)
+    with db.transaction() as conn:
+        seeded = conn.execute(
+            "SELECT COUNT(*) FROM couples WHERE id BETWEEN 1 AND ? AND user1_email = 'bench-user-' || id || '@example.com'",
+            (couples,)
+        ).fetchone()[0]
+        if seeded == couples:
+            return  # reusing a database seeded earlier
+        if conn.execute('SELECT 1 FROM couples LIMIT 1').fetchone():
+            raise RuntimeError(
+                f'{db.DATABASE_PATH} already has couples that seed() did not create; '
+                'virtual users would not map to their couples. Seed an empty database.'
+            )
+    for start in range(1, couples + 1, SEED_BATCH_SIZE):
+        ids = range(start, min(start + SEED_BATCH_SIZE, couples + 1))
+        with db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO couples (id, user1_email, user2_email) VALUES (?, ?, ?)',
+                ((n, user_email(n), partner_email(n)) for n in ids)
+            )
+            conn.executemany(
+                'INSERT INTO words (couple_id, text, sender_email) VALUES (?, ?, ?)',
+                ((n, rng.choice(LOREM), rng.choice((user_email(n), partner_email(n))))
+                 for n in ids for _ in range(words_per_couple))
+            )
+            conn.executemany(
+                'INSERT INTO images (couple_id, filename, note) VALUES (?, ?, ?)',
+                ((n, f'bench/{n}-{i}.jpg', rng.choice(LOREM))
+                 for n in ids for i in range(images_per_couple))
+            )
+    with db.connection() as conn:
+        conn.execute('ANALYZE')
+
+
+def make_app(database_path=None, replicate_delay=0.0, extra_config=None):
+    """Create the app against a benchmark database with every external service faked."""
+    if database_path is None:
+        database_path = os.path.join(tempfile.mkdtemp(prefix='couplecenter-bench-'), 'bench.db')
+    invitations.set_client(invitations.FakeReplicate(delay=replicate_delay))
+    config = {
+        'SECRET_KEY': BENCH_SECRET_KEY,
+        'DATABASE_PATH': database_path,
+        'USERINFO_PROVIDER': fake_userinfo,
+        'UPLOAD_FOLDER': os.path.join(os.path.dirname(database_path), 'uploads'),
+        'RATELIMIT_ENABLED': False,  # virtual users post far faster than people
+    }
+    config.update(extra_config or {})
+    app = create_app(config)
+    jobs.start_for(app)
+    return app
+
+
+def session_cookie(app, n):
+    """Signed session cookie value for virtual user n, already linked to couple n."""
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({
+        'google_oauth_token': {'access_token': f'bench-{n}', 'token_type': 'Bearer'},
+        'couple_id': n,
+        'user_email': user_email(n),
+    })
+
+
+class ServerThread(threading.Thread):
+    """Serve the app on a free local port with werkzeug's threaded server."""
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        super().__init__(daemon=True)
+        self.server = make_server(host, port, app, threaded=True)
+        self.url = f'http://{host}:{self.server.server_port}'
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def wait_until_up(url, timeout=10):
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url + '/errorLogin', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Server at {url} did not come up')
@@ -0,0 +1,196 @@
+"""Closed-loop load test for the main pages, fully offline.
+
+    cd backend
+    python -m bench.loadtest --couples 10000 --users 32 --duration 30 --output results.json
+    python -m bench.loadtest --couples 10000 --baseline results.json
+
+Starts the app on a local threaded server with faked Google login and
+Replicate (see harness.py), seeds the database, then runs ``--users``
+virtual users that each request random pages as fast as responses come
+back. Results are JSON: throughput and p50/p95/p99 latency per route and
+overall. With ``--baseline`` the p50/p95/p99 change against an earlier run
+is reported as well.
+
+To measure the production server setup instead, seed a database, serve
+bench/wsgi.py with gunicorn and point ``--url`` at it::
+
+    python -m bench.loadtest --couples 100000 --database /tmp/bench.db --seed-only
+    BENCH_DATABASE=/tmp/bench.db DATABASE_PATH=/tmp/bench.db gunicorn -c gunicorn.conf.py bench.wsgi:app
+    python -m bench.loadtest --couples 100000 --database /tmp/bench.db --url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+from bench import harness
+
+DEFAULT_ROUTES = ('/', '/gallery', '/words-together', '/profile', '/partner-management')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(values, 50) * 1000, 2) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 2) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 2) if values else None,
+    }
+
+
+def virtual_user(url, cookie, routes, write_ratio, stop_at, results, lock, rng):
+    session = requests.Session()
+    session.cookies.set('session', cookie)
+    local = {route: ([], 0) for route in routes}
+    while time.monotonic() < stop_at:
+        route = rng.choice(routes)
+        post = write_ratio and route == '/words-together' and rng.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if post:
+                response = session.post(url + route, data={'text': 'bench message'}, allow_redirects=False)
+                ok = response.status_code in (200, 302)
+            else:
+                response = session.get(url + route, allow_redirects=False)
+                ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        latencies, errors = local[route]
+        if ok:
+            latencies.append(elapsed)
+        else:
+            local[route] = (latencies, errors + 1)
+    with lock:
+        for route, (latencies, errors) in local.items():
+            results[route][0].extend(latencies)
+            results[route][1] += errors
+
+
+def run(url, app, couples, users, duration, routes, write_ratio, seed_value):
+    rng = random.Random(seed_value)
+    results = {route: [[], 0] for route in routes}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    threads = []
+    for _ in range(users):
+        n = rng.randint(1, couples)
+        thread = threading.Thread(target=virtual_user, args=(
+            url, harness.session_cookie(app, n), routes, write_ratio, stop_at,
+            results, lock, random.Random(rng.random())
+        ))
+        threads.append(thread)
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    report = {'routes': {}}
+    all_latencies, all_errors = [], 0
+    for route, (latencies, errors) in results.items():
+        report['routes'][route] = summarize(latencies, errors, elapsed)
+        all_latencies += latencies
+        all_errors += errors
+    report['overall'] = summarize(all_latencies, all_errors, elapsed)
+    return report
+
+
+def compare(report, baseline):
+    def delta(new, old):
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    changes = {}
+    for route, stats in list(report['routes'].items()) + [('overall', report['overall'])]:
+        old = baseline['routes'].get(route) if route != 'overall' else baseline.get('overall')
+        if old:
+            changes[route] = {
+                f'{key}_change_pct': delta(stats[key], old[key])
+                for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')
+            }
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--couples', type=int, default=1000, help='couples to seed (1k to 1M)')
+    parser.add_argument('--words-per-couple', type=int, default=20)
+    parser.add_argument('--images-per-couple', type=int, default=5)
+    parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=15, help='seconds to run')
+    parser.add_argument('--routes', nargs='+', default=list(DEFAULT_ROUTES))
+    parser.add_argument('--write-ratio', type=float, default=0.0,
+                        help='share of /words-together requests that post a message')
+    parser.add_argument('--database', help='database file to seed and reuse (default: a temp file)')
+    parser.add_argument('--replicate-delay', type=float, default=0.0, help='seconds the fake Replicate takes')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--seed-only', action='store_true', help='seed the database and exit')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for data and traffic')
+    parser.add_argument('--baseline', help='earlier JSON result to compare against')
+    parser.add_argument('--output', help='write the JSON result here as well as to stdout')
+    args = parser.parse_args(argv)
+
+    app = harness.make_app(args.database, replicate_delay=args.replicate_delay)
+    seed_start = time.monotonic()
+    harness.seed(args.couples, args.words_per_couple, args.images_per_couple, args.seed)
+    seed_seconds = time.monotonic() - seed_start
+    if args.seed_only:
+        print(json.dumps({'database': app.config['DATABASE_PATH'], 'seed_seconds': round(seed_seconds, 2)}))
+        return 0
+
+    server = None
+    url = args.url
+    if url is None:
+        server = harness.ServerThread(app)
+        server.start()
+        url = server.url
+    harness.wait_until_up(url)
+    try:
+        report = run(url, app, args.couples, args.users, args.duration, args.routes, args.write_ratio, args.seed)
+    finally:
+        if server:
+            server.stop()
+
+    report['config'] = {
+        'couples': args.couples,
+        'words_per_couple': args.words_per_couple,
+        'images_per_couple': args.images_per_couple,
+        'users': args.users,
+        'duration': args.duration,
+        'write_ratio': args.write_ratio,
+        'seed_seconds': round(seed_seconds, 2),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['vs_baseline'] = compare(report, json.load(f))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Write throughput: per-row commits against group commit and the bulk endpoint.
+
+    cd backend
+    python -m bench.writes --users 32 --duration 15 --output writes.json
+
+Runs the same closed loop of ``--users`` virtual users posting messages
+three times, each on a fresh database seeded with ``--couples`` couples:
+
+    per_row   POST /words-together, GROUP_COMMIT off (one commit per message)
+    grouped   POST /words-together, GROUP_COMMIT on
+    bulk      POST /api/words with ``--bulk-size`` messages per request
+
+Results are JSON with messages/s, requests/s and request latency per
+scenario; ``errors`` counts failed requests, e.g. "database is locked".
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench import harness
+from bench.loadtest import summarize
+
+SCENARIOS = ('per_row', 'grouped', 'bulk')
+
+
+def virtual_user(url, cookie, bulk_size, stop_at, results, lock):
+    session = requests.Session()
+    session.cookies.set('session', cookie)
+    latencies, errors, messages = [], 0, 0
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        try:
+            if bulk_size:
+                response = session.post(url + '/api/words', json={'texts': ['bench message'] * bulk_size})
+                ok = response.status_code == 201
+            else:
+                response = session.post(url + '/words-together', data={'text': 'bench message'}, allow_redirects=False)
+                ok = response.status_code == 302
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+            messages += bulk_size or 1
+        else:
+            errors += 1
+    with lock:
+        results['latencies'] += latencies
+        results['errors'] += errors
+        results['messages'] += messages
+
+
+def run_scenario(name, args):
+    database = os.path.join(tempfile.mkdtemp(prefix=f'couplecenter-writes-{name}-'), 'bench.db')
+    app = harness.make_app(database, extra_config={'GROUP_COMMIT': name != 'per_row', 'PAGE_CACHE': False})
+    harness.seed(args.couples, words_per_couple=0, images_per_couple=0, seed_value=args.seed)
+    server = harness.ServerThread(app)
+    server.start()
+    harness.wait_until_up(server.url)
+
+    rng = random.Random(args.seed)
+    results = {'latencies': [], 'errors': 0, 'messages': 0}
+    lock = threading.Lock()
+    bulk_size = args.bulk_size if name == 'bulk' else 0
+    stop_at = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=virtual_user, args=(
+            server.url, harness.session_cookie(app, rng.randint(1, args.couples)), bulk_size, stop_at, results, lock
+        ))
+        for _ in range(args.users)
+    ]
+    started = time.monotonic()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.stop()
+    elapsed = time.monotonic() - started
+
+    report = summarize(results['latencies'], results['errors'], elapsed)
+    report['messages'] = results['messages']
+    report['messages_per_second'] = round(results['messages'] / elapsed, 2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--couples', type=int, default=100, help='couples to seed; users pick one at random')
+    parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+    parser.add_argument('--bulk-size', type=int, default=50, help='messages per /api/words request')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON result here as well as to stdout')
+    args = parser.parse_args(argv)
+
+    report = {'scenarios': {name: run_scenario(name, args) for name in args.scenarios}}
+    report['config'] = {
+        'couples': args.couples,
+        'users': args.users,
+        'duration': args.duration,
+        'bulk_size': args.bulk_size,
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
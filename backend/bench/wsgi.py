@@ -0,0 +1,13 @@
+"""The benchmark app (fake login and Replicate) for production servers.
+
+    BENCH_DATABASE=/tmp/bench.db DATABASE_PATH=/tmp/bench.db gunicorn -c gunicorn.conf.py bench.wsgi:app
+
+gunicorn.conf.py's on_starting hook migrates DATABASE_PATH in the master
+before any worker imports this module, so it must name the bench database
+too; the workers then skip migrations.
+"""
+import os
+
+from bench import harness
+
+app = harness.make_app(os.environ['BENCH_DATABASE'])
@@ -0,0 +1,82 @@
+"""Small key/value caches for data that is read on every page.
+
+LRUCache lives in the process and evicts the least recently used entry once
+full. RedisCache keeps the same interface on a Redis-compatible server (see
+redisclient.py) so several worker processes see each other's invalidations. Values must be
+JSON-serializable for RedisCache to store them.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redisclient
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    def __init__(self, url, prefix, ttl=None):
+        self._redis = redisclient.client(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self._redis.get(self.prefix + str(key))
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        self._redis.set(self.prefix + str(key), json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self._redis.delete(*(self.prefix + str(key) for key in keys))
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(self.prefix + '*'))
+        if keys:
+            self._redis.delete(*keys)
+
+
+def make_cache(url=None, prefix='couplecenter:', max_entries=1024, ttl=None):
+    """LRUCache by default; a RedisCache when given a ``redis://`` URL."""
+    if url:
+        return RedisCache(url, prefix, ttl)
+    return LRUCache(max_entries, ttl)
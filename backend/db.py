@@ -0,0 +1,241 @@
+"""Shared SQLite data-access layer.
+
+Every data helper in main.py goes through this module instead of opening its
+own connection. All data lives in a single database file (see migrations.py
+for the schema). Connections are kept in a small bounded pool, tuned once
+with the pragmas below, and reused for the whole request through Flask's app
+context.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+
+import metrics
+
+DEFAULT_DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'couplecenter.db')
+DATABASE_PATH = os.getenv('DATABASE_PATH', DEFAULT_DATABASE_PATH)
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# sqlite3 keeps compiled statements per connection; since connections live in
+# the pool this cache survives across requests.
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',     # WAL commits are not synced; writes.py syncs its own
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA foreign_keys=ON',
+    'PRAGMA cache_size=-16000',       # ~16 MB page cache per connection
+    'PRAGMA mmap_size=268435456',     # 256 MB memory-mapped reads
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that reports every statement's duration to metrics.py."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - start)
+
+    def fetch(self, sql, parameters=(), one=False):
+        # Times the statement together with reading its rows.
+        start = time.perf_counter()
+        try:
+            cur = super().execute(sql, parameters)
+            return cur.fetchone() if one else cur.fetchall()
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - start)
+
+    def commit(self):
+        if not self.in_transaction:
+            return
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.observe_sql('COMMIT', time.perf_counter() - start)
+
+
+def connect(path, timeout=POOL_TIMEOUT):
+    """Open a connection tuned like the pooled ones, for callers that keep their own."""
+    conn = sqlite3.connect(
+        path,
+        timeout=timeout,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=TimedConnection,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of connections to the database file.
+
+    A connection is only ever used by one thread at a time: it is checked out,
+    used, and handed back. Idle connections are reused most-recently-used
+    first so the hot ones keep a warm page and statement cache.
+    """
+
+    def __init__(self, path, max_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect(self.path, self.timeout)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(f'Timed out waiting for a connection to {self.path}')
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path):
+    """Point the data layer at another database file (tests, benchmarks)."""
+    global DATABASE_PATH, _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        DATABASE_PATH = path
+        _pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_PATH)
+    return _pool
+
+
+def get_db():
+    """Return the connection this request is using.
+
+    The first call in a request checks a connection out of the pool; later
+    calls reuse it, and it goes back to the pool when the app context ends.
+    """
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn = g._db_conn = get_pool().acquire()
+    return conn
+
+
+def close_db(exc=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def use_unscoped_connections():
+    """Check a connection out per connection() call for the rest of this app context.
+
+    For background jobs: they run in an app context so handlers can use
+    current_app, but must not keep a pooled connection for as long as the job
+    runs (a whole Replicate call, say).
+    """
+    g._db_unscoped = True
+
+
+@contextmanager
+def connection():
+    """Yield a pooled connection, request-scoped when inside an app context."""
+    if has_app_context() and not g.get('_db_unscoped'):
+        yield get_db()
+        return
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction():
+    """Run several statements atomically; commits on success, rolls back on error."""
+    with connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def query(sql, params=()):
+    with connection() as conn:
+        return conn.fetch(sql, params)
+
+
+def query_one(sql, params=()):
+    with connection() as conn:
+        return conn.fetch(sql, params, one=True)
+
+
+def execute(sql, params=()):
+    """Run a single write statement and commit it. Returns the cursor."""
+    with transaction() as conn:
+        return conn.execute(sql, params)
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
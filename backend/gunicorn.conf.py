@@ -0,0 +1,52 @@
+"""Gunicorn settings for running CoupleCenter in production.
+
+    cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+
+Every value can be tuned from the environment. Threaded workers (gthread)
+are used because /api/words/stream keeps a long-lived connection per open
+Words Together page, and each one holds a thread for as long as it is open.
+A worker therefore serves at most SSE_MAX_STREAMS of them (keep it below
+THREADS) and ends each after SSE_MAX_AGE seconds; pages over the limit
+retry later. With more than one worker, PUBSUB_URL must be set or messages
+only reach the pages open on the worker that received them.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+# The settings below and the app modules on_starting imports read backend/.env too.
+load_dotenv(os.path.join(chdir, '.env'))
+bind = os.getenv('BIND', '0.0.0.0:8000')
+
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('THREADS', '8'))
+keepalive = int(os.getenv('KEEPALIVE', '5'))  # seconds an idle keep-alive connection stays open
+timeout = int(os.getenv('TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+# Recycle workers now and then so slow leaks never build up.
+max_requests = int(os.getenv('MAX_REQUESTS', '5000'))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', '500'))
+
+# The app is loaded in each worker after the fork, so the job worker threads
+# and database connections belong to the process that uses them.
+preload_app = False
+
+accesslog = os.getenv('ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    # Let create_app() know it is one of several processes (see its warnings).
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+    # Apply migrations once in the master instead of in every worker.
+    from main import migrations
+    migrations.migrate()
+    os.environ['MIGRATE_ON_START'] = '0'
+    # Likewise build the asset bundles once, from the committed files, if the
+    # deploy did not.
+    import assets
+    if assets.load_manifest() is None:
+        assets.build()
@@ -0,0 +1,158 @@
+"""AI invitation cards generated in the background.
+
+A request submits a prompt and gets a job id back straight away; the
+Replicate call runs on the job workers (see jobs.py). Finished images are
+downloaded once and kept under ``invitations/`` in the store (storage.py), and a cache keyed on
+(model, normalized prompt) lets a repeated prompt skip the model entirely.
+
+The client is anything with replicate's ``run(model, input=...)`` signature.
+Set REPLICATE_BACKEND=fake, or call set_client(), to generate images locally
+for tests and benchmarks.
+"""
+import hashlib
+import io
+import os
+import time
+
+import replicate
+import requests
+
+import db
+import jobs
+import media
+import metrics
+import quotas
+import storage
+
+MODEL = 'prunaai/flux.1-dev:970a966e3a5d8aa9a4bf13d395cf49c975dc4726e359f982fb833f9b100f75d5'
+MAX_PER_COUPLE = int(os.getenv('INVITATION_MAX_PER_COUPLE', '2'))  # unfinished jobs per couple
+CACHE_TTL = int(os.getenv('INVITATION_CACHE_TTL', str(7 * 86400)))  # seconds
+CACHE_SIZE = int(os.getenv('INVITATION_CACHE_SIZE', '500'))  # entries kept, least recently used evicted
+DOWNLOAD_TIMEOUT = 60
+SUBDIR = 'invitations'
+BUSY_RETRY_AFTER = 10  # seconds a couple with MAX_PER_COUPLE cards in progress is told to wait
+
+
+class TooManyInvitations(quotas.QuotaExceeded):
+    def __init__(self, message, retry_after=BUSY_RETRY_AFTER):
+        super().__init__(message, retry_after)
+
+
+class FakeReplicate:
+    """Stand-in for the replicate module that draws a plain card locally."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def run(self, model, input):
+        from PIL import Image, ImageDraw
+
+        self.calls += 1
+        time.sleep(self.delay)
+        image = Image.new('RGB', (512, 512), (255, 106, 136))
+        ImageDraw.Draw(image).text((24, 240), input['prompt'][:60], fill='white')
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return [buffer.getvalue()]
+
+
+_client = FakeReplicate() if os.getenv('REPLICATE_BACKEND') == 'fake' else replicate
+
+
+def set_client(client):
+    global _client
+    _client = client
+
+
+def normalize_prompt(prompt):
+    return ' '.join(prompt.split()).casefold()
+
+
+def cache_key(prompt, model=MODEL):
+    return hashlib.sha256(f'{model}\n{normalize_prompt(prompt)}'.encode()).hexdigest()
+
+
+def cached_image(key):
+    """Return the stored filename for a live cache entry and mark it used."""
+    row = db.query_one(
+        'SELECT filename FROM invitation_cache WHERE cache_key=? AND created_at > ?',
+        (key, time.time() - CACHE_TTL)
+    )
+    if row:
+        db.execute('UPDATE invitation_cache SET last_used=? WHERE cache_key=?', (time.time(), key))
+        return row[0]
+    return None
+
+
+def _evict(store):
+    with db.transaction() as conn:
+        stale = conn.execute('''
+            DELETE FROM invitation_cache WHERE created_at <= ?1 OR cache_key IN (
+                SELECT cache_key FROM invitation_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?2
+            ) RETURNING filename
+        ''', (time.time() - CACHE_TTL, CACHE_SIZE)).fetchall()
+    for (filename,) in stale:
+        if not db.query_one('SELECT 1 FROM invitation_cache WHERE filename=?', (filename,)):
+            media.remove_blob(store, filename)
+
+
+def _image_bytes(output):
+    # replicate.run returns a list of FileOutput objects (or URLs with older
+    # clients); the fake returns raw bytes.
+    if isinstance(output, (list, tuple)):
+        if not output:
+            raise ValueError('No image generated. Try a different prompt.')
+        output = output[0]
+    if isinstance(output, bytes):
+        return output
+    if hasattr(output, 'read'):
+        return output.read()
+    with metrics.timed('replicate', 'download'):
+        response = requests.get(str(output), timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+
+def generate(prompt, store):
+    """Produce (or reuse) the card for ``prompt`` and return its stored filename."""
+    key = cache_key(prompt)
+    filename = cached_image(key)
+    if filename:
+        return filename
+    with metrics.timed('replicate', 'run'):
+        output = _client.run(MODEL, input={'prompt': prompt})
+    data = _image_bytes(output)
+    ext = media.sniff_image_type(data[:16]) or 'png'
+    filename = f'{SUBDIR}/{media.blob_name(hashlib.sha256(data).hexdigest(), ext)}'
+    if not store.exists(filename):
+        with storage.staged(store) as tmp_path:
+            with open(tmp_path, 'wb') as out:
+                out.write(data)
+            store.put(filename, tmp_path)
+    now = time.time()
+    db.execute(
+        'INSERT OR REPLACE INTO invitation_cache (cache_key, model, prompt, filename, created_at, last_used) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (key, MODEL, normalize_prompt(prompt), filename, now, now)
+    )
+    _evict(store)
+    return filename
+
+
+def submit(prompt, couple_id, per_day=quotas.INVITATIONS_PER_DAY):
+    """Queue a card for ``prompt``; returns the job id.
+
+    Raises TooManyInvitations when the couple already has MAX_PER_COUPLE
+    cards in progress, and quotas.QuotaExceeded after ``per_day`` cards
+    today. A rejected card does not count towards either.
+    """
+    with db.transaction() as conn:
+        quotas.consume_daily(conn, couple_id, 'invitations', per_day)
+        job_id = jobs.enqueue(
+            'generate_invitation', {'prompt': prompt}, couple_id,
+            max_attempts=2, limit_per_couple=MAX_PER_COUPLE, conn=conn
+        )
+        if job_id is None:
+            raise TooManyInvitations('Please wait for your other invitations to finish.')
+    return job_id
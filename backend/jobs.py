@@ -0,0 +1,213 @@
+"""Background job queue stored in the application database.
+
+Slow work (image derivatives, file cleanup, bulk purges) is enqueued as a
+row in the ``jobs`` table and picked up by a small pool of worker threads,
+so it survives restarts and can be shared by several worker processes::
+
+    @jobs.handler('make_derivatives')
+    def make_derivatives(payload):
+        ...
+
+    job_id = jobs.enqueue('make_derivatives', {'filename': ...}, couple_id=...)
+
+A failing job is retried with exponential backoff until max_attempts, then
+marked ``failed`` with the last error.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import db
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+POLL_INTERVAL = 1.0    # seconds between polls when the queue is empty
+RETRY_BACKOFF = 2.0    # seconds, doubled after every failed attempt
+STALE_AFTER = 600      # a running job not finished after this long is retried
+KEEP_FINISHED = 86400  # finished jobs stay visible to the status endpoint this long
+
+_handlers = {}
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads = []
+_app = None
+
+
+def handler(kind):
+    """Register the function that runs jobs of ``kind``."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload=None, couple_id=None, max_attempts=5, conn=None, limit_per_couple=None):
+    """Add a job and return its id.
+
+    Pass ``conn`` to enqueue inside a surrounding db.transaction(), so the job
+    only exists if the rest of the write commits. With ``limit_per_couple``,
+    nothing is added and None is returned when the couple already has that
+    many unfinished jobs of this kind; the check and the insert are a single
+    statement, so concurrent requests cannot both slip under the limit.
+    """
+    params = (kind, json.dumps(payload or {}), couple_id, max_attempts)
+    if limit_per_couple is None:
+        sql = 'INSERT INTO jobs (kind, payload, couple_id, max_attempts) VALUES (?, ?, ?, ?)'
+    else:
+        sql = (
+            'INSERT INTO jobs (kind, payload, couple_id, max_attempts) SELECT ?1, ?2, ?3, ?4 '
+            "WHERE (SELECT COUNT(*) FROM jobs WHERE kind=?1 AND couple_id=?3 AND status IN ('queued', 'running')) < ?5"
+        )
+        params += (limit_per_couple,)
+    cur = conn.execute(sql, params) if conn else db.execute(sql, params)
+    if not cur.rowcount:
+        return None
+    _wakeup.set()
+    return cur.lastrowid
+
+
+def get_job(job_id, couple_id=None):
+    row = db.query_one(
+        'SELECT id, kind, status, attempts, max_attempts, result, last_error, created_at, updated_at '
+        'FROM jobs WHERE id=? AND (? IS NULL OR couple_id=?)',
+        (job_id, couple_id, couple_id)
+    )
+    if not row:
+        return None
+    keys = ('id', 'kind', 'status', 'attempts', 'max_attempts', 'result', 'error', 'created_at', 'updated_at')
+    job = dict(zip(keys, row))
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def claim():
+    """Atomically take the oldest runnable job, or return None."""
+    now = time.time()
+    with db.transaction() as conn:
+        return conn.execute('''
+            UPDATE jobs SET status='running', attempts=attempts + 1, updated_at=CURRENT_TIMESTAMP,
+                            lease_until=?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status='queued' AND run_after <= ?)
+                   OR (status='running' AND lease_until < ?)
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts, max_attempts
+        ''', (now + STALE_AFTER, now, now)).fetchone()
+
+
+@contextmanager
+def _job_context():
+    # Handlers run inside the app context so they can use current_app, but
+    # take a connection per statement or transaction rather than one held
+    # from the start of the job to the end.
+    if _app is None:
+        yield
+        return
+    with _app.app_context():
+        db.use_unscoped_connections()
+        yield
+
+
+def run_one():
+    """Run the next job if there is one. Returns True if a job was run."""
+    job = claim()
+    if job is None:
+        return False
+    job_id, kind, payload, attempts, max_attempts = job
+    try:
+        fn = _handlers.get(kind)
+        if fn is None:
+            raise LookupError(f'No handler registered for job kind {kind!r}')
+        with _job_context():
+            result = fn(json.loads(payload))
+    except Exception:
+        error = traceback.format_exc(limit=5)
+        logger.warning('Job %s (%s) failed on attempt %s:\n%s', job_id, kind, attempts, error)
+        if attempts >= max_attempts:
+            db.execute(
+                "UPDATE jobs SET status='failed', last_error=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                (error, job_id)
+            )
+        else:
+            db.execute(
+                "UPDATE jobs SET status='queued', last_error=?, run_after=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                (error, time.time() + RETRY_BACKOFF * 2 ** (attempts - 1), job_id)
+            )
+    else:
+        db.execute(
+            "UPDATE jobs SET status='done', result=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+            (json.dumps(result) if result is not None else None, job_id)
+        )
+    return True
+
+
+def prune(older_than=KEEP_FINISHED):
+    db.execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < datetime('now', ?)",
+        (f'-{int(older_than)} seconds',)
+    )
+
+
+def _work():
+    last_prune = 0
+    while not _stop.is_set():
+        try:
+            ran = run_one()
+            if not ran and time.monotonic() - last_prune > 600:
+                prune()
+                last_prune = time.monotonic()
+        except Exception:
+            logger.exception('Job worker crashed; retrying')
+            ran = False
+        if not ran:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start(workers=WORKERS):
+    """Start the worker threads (idempotent)."""
+    if _threads:
+        return
+    _stop.clear()
+    for i in range(workers):
+        thread = threading.Thread(target=_work, name=f'job-worker-{i}', daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+def init_app(app):
+    """Run handlers for ``app``.
+
+    Workers are not started here, so CLI commands and scripts that create the
+    app do not run jobs; the server entry points call start_for(app).
+    """
+    global _app
+    _app = app
+
+
+def start_for(app):
+    """Start ``app``'s JOB_WORKERS worker threads (none when it is 0)."""
+    if app.config.get('JOB_WORKERS', WORKERS):
+        start(app.config.get('JOB_WORKERS', WORKERS))
+
+
+def stop(timeout=5):
+    _stop.set()
+    _wakeup.set()
+    for thread in _threads:
+        thread.join(timeout)
+    _threads.clear()
+
+
+def drain(timeout=30):
+    """Run queued jobs in the calling thread until none are left (scripts, benchmarks)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and run_one():
+        pass
@@ -1,112 +1,186 @@
-from flask import Flask, request, render_template, redirect, url_for, session, abort
+from flask import Flask, Blueprint, current_app, request, render_template, redirect, url_for, session, abort, jsonify, Response, send_from_directory
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from datetime import datetime, timezone
 from flask_cors import CORS
 from flask_dance.contrib.google import make_google_blueprint, google
 import os   
 from dotenv import load_dotenv
+# Before the local modules below: they read their settings from the
+# environment when imported.
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
 import secrets
-import replicate
-
-
-load_dotenv()  # Load environment variables from .env file
-# --- SQLite setup for WordsTogether (text sharing) ---
-import sqlite3
-# --- SQLite setup for WordsTogether (text sharing) ---
-WORDS_DB_PATH = os.path.join(os.path.dirname(__file__), 'WordsTogether.db')
-
-def init_words_db():
-    conn = sqlite3.connect('WordsTogether.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS words (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            text TEXT NOT NULL,
-            couple_id INTEGER,
-            sender_email TEXT,
-            FOREIGN KEY (couple_id) REFERENCES couples(id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_words_db()  # Initialize WordsTogether DB on startup
-
-def get_words(couple_id):
-    conn = sqlite3.connect(WORDS_DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, text, sender_email FROM words WHERE couple_id=? ORDER BY id DESC LIMIT 20', (couple_id,))
-    words = c.fetchall()
-    conn.close()
-    return words
+import db
+import migrations
+import pubsub
+import media
+import jobs
+import invitations
+import cache
+import hashlib
+import metrics
+import assets
+import search
+import pages
+import archive
+import writes
+import storage
+import quotas
+import ratelimit
+import redisclient
+import json
+import mimetypes
+import re
+import threading
+import time
+
+
+# --- SQLite setup ---
+# All data lives in one database (db.DATABASE_PATH); the schema is defined
+# by the versioned migrations in migrations.py, applied by create_app().
+
+# Feeds are paged newest-first by id ("keyset" pagination): a page starts
+# just below the last id the client has seen, which the (couple_id, id DESC)
+# indexes serve directly however deep the history goes.
+NEWEST = 2 ** 63 - 1
+
+def get_feed_state(couple_id, feed):
+    row = db.query_one('SELECT revision, updated_at FROM feed_state WHERE couple_id=? AND feed=?', (couple_id, feed))
+    return row if row else (0, None)
+
+# --- WordsTogether (text sharing) ---
+# add_word/delete_word publish deltas to open /api/words/stream connections.
+# Set PUBSUB_URL=redis://... to fan out across several worker processes.
+# Feed writes go through writes.run(), which commits concurrent writes
+# together and returns once the caller's own write is committed.
+PUBSUB_URL = redisclient.setting_url('PUBSUB_URL')
+hub = pubsub.make_hub(PUBSUB_URL)
+
+def get_words(couple_id, before=None, limit=20):
+    return db.query(
+        'SELECT id, text, sender_email FROM words WHERE couple_id=? AND id<? ORDER BY id DESC LIMIT ?',
+        (couple_id, before or NEWEST, limit)
+    )
 
 def add_word(text, couple_id, sender_email):
-    conn = sqlite3.connect(WORDS_DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO words (text, couple_id, sender_email) VALUES (?, ?, ?)', (text, couple_id, sender_email))
-    conn.commit()
-    conn.close()
-
-def delete_word(word_id):
-    conn = sqlite3.connect(WORDS_DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM words WHERE id=?', (word_id,))
-    conn.commit()
-    conn.close()
-
-# --- SQLite setup for gallery ---
-import sqlite3
-
-DB_PATH = os.path.join(os.path.dirname(__file__), 'gallery.db')
-
-def init_db():
-    conn = sqlite3.connect('gallery.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            note TEXT,
-            couple_id INTEGER,
-            FOREIGN KEY (couple_id) REFERENCES couples(id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_db()  # Initialize DB on startup
-
-def get_images(couple_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, filename, note FROM images WHERE couple_id=? ORDER BY id DESC LIMIT 10', (couple_id,))
-    images = c.fetchall()
-    conn.close()
-    return images
-
-def add_image(filename, note, couple_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO images (filename, note, couple_id) VALUES (?, ?, ?)', (filename, note, couple_id))
-    conn.commit()
-    conn.close()
-
-def delete_image(image_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT filename FROM images WHERE id=?', (image_id,))
-    row = c.fetchone()
-    if row:
-        filename = row[0]
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        c.execute('DELETE FROM images WHERE id=?', (image_id,))
-        conn.commit()
-    conn.close()
-
+    return add_words([text], couple_id, sender_email)[0]
+
+def add_words(texts, couple_id, sender_email):
+    """Insert several messages in one write; returns their ids in order."""
+    def write(conn):
+        return [
+            conn.execute(
+                'INSERT INTO words (text, couple_id, sender_email) VALUES (?, ?, ?)', (text, couple_id, sender_email)
+            ).lastrowid
+            for text in texts
+        ]
+    word_ids = writes.run(write)
+    pages.invalidate('words', couple_id)
+    for word_id, text in zip(word_ids, texts):
+        hub.publish(couple_id, {'type': 'add', 'id': word_id, 'text': text, 'sender': sender_email})
+    return word_ids
+
+def delete_word(word_id, couple_id):
+    deleted = writes.run(
+        lambda conn: conn.execute('DELETE FROM words WHERE id=? AND couple_id=?', (word_id, couple_id)).rowcount
+    )
+    if deleted:
+        pages.invalidate('words', couple_id)
+        hub.publish(couple_id, {'type': 'delete', 'id': int(word_id)})
+
+# --- Gallery ---
+# Uploads are content-addressed by media.ingest(), so one file may back
+# several rows; it is only removed once the last row pointing at it is gone.
+def get_images(couple_id, before=None, limit=10):
+    return db.query(
+        'SELECT id, filename, note, content_hash, derivatives_ready FROM images '
+        'WHERE couple_id=? AND id<? ORDER BY id DESC LIMIT ?',
+        (couple_id, before or NEWEST, limit)
+    )
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)  # Generate a random secret key
-CORS(app)  # Enable CORS for cross-origin requests
+def add_image(filename, note, couple_id, content_hash=None):
+    """Insert a photo row; raises quotas.QuotaExceeded when the gallery is full."""
+    max_images = current_app.config['GALLERY_MAX_IMAGES']
+
+    def write(conn):
+        # A deduplicated upload reuses derivatives that already exist.
+        ready = conn.execute(
+            'SELECT MAX(derivatives_ready) FROM images WHERE content_hash=?', (content_hash,)
+        ).fetchone()[0] if content_hash else 0
+        image_id = conn.execute(
+            'INSERT INTO images (filename, note, couple_id, content_hash, derivatives_ready) VALUES (?, ?, ?, ?, ?)',
+            (filename, note, couple_id, content_hash, ready or 0)
+        ).lastrowid
+        quotas.check_images(conn, couple_id, max_images)  # rolls the insert back when over
+        if content_hash and not ready:
+            jobs.enqueue('make_derivatives', {'filename': filename, 'content_hash': content_hash}, couple_id, conn=conn)
+        return image_id
+    try:
+        image_id = writes.run(write)
+    except quotas.QuotaExceeded:
+        remove_unreferenced_files([(filename, content_hash)])
+        raise
+    pages.invalidate('images', couple_id)
+    return image_id
+
+def remove_unreferenced_files(files):
+    # files: (filename, content_hash) pairs whose rows were just deleted
+    for filename, content_hash in set(files):
+        if not db.query_one('SELECT 1 FROM images WHERE filename=? LIMIT 1', (filename,)):
+            media.remove_blob(storage.current(), filename, content_hash)
+
+def delete_image(image_id, couple_id):
+    row = writes.run(lambda conn: conn.execute(
+        'DELETE FROM images WHERE id=? AND couple_id=? RETURNING filename, content_hash', (image_id, couple_id)
+    ).fetchone())
+    if not row:
+        return
+    pages.invalidate('images', couple_id)
+    remove_unreferenced_files([row])
+
+# --- Background jobs (see jobs.py) ---
+PURGE_BATCH_SIZE = 500
+
+@jobs.handler('make_derivatives')
+def make_derivatives_job(payload):
+    media.make_derivatives(storage.current(), payload['filename'], payload['content_hash'])
+    db.execute('UPDATE images SET derivatives_ready=1 WHERE content_hash=?', (payload['content_hash'],))
+
+@jobs.handler('purge_couple_data')
+def purge_couple_data_job(payload):
+    # Deletes in small transactions so writers are never blocked for long.
+    # Only rows up to the ids seen when the purge was requested are removed;
+    # anything posted afterwards is kept.
+    couple_id = payload['couple_id']
+    deleted = {'images': 0, 'words': 0}
+    while True:
+        with db.transaction() as conn:
+            rows = conn.execute(
+                'DELETE FROM images WHERE id IN (SELECT id FROM images WHERE couple_id=? AND id<=? LIMIT ?) '
+                'RETURNING filename, content_hash',
+                (couple_id, payload['max_image_id'], PURGE_BATCH_SIZE)
+            ).fetchall()
+        if not rows:
+            break
+        deleted['images'] += len(rows)
+        remove_unreferenced_files(rows)
+    while True:
+        count = db.execute(
+            'DELETE FROM words WHERE id IN (SELECT id FROM words WHERE couple_id=? AND id<=? LIMIT ?)',
+            (couple_id, payload['max_word_id'], PURGE_BATCH_SIZE)
+        ).rowcount
+        if not count:
+            break
+        deleted['words'] += count
+    return deleted
+
+@jobs.handler('generate_invitation')
+def generate_invitation_job(payload):
+    return {'filename': invitations.generate(payload['prompt'], storage.current())}
+
+
+# All pages live on this blueprint; create_app() builds the actual app.
+bp = Blueprint('main', __name__)
 
 # Helper: login_required decorator
 def login_required(f):
@@ -115,34 +189,25 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         # Only redirect if NOT logged in
         if not session.get("google_oauth_token"):
-            return redirect(url_for("errorLogin"))
+            if request.path.startswith('/api/'):
+                abort(401)
+            return redirect(url_for("main.errorLogin"))
         return f(*args, **kwargs)
     return decorated_function
 
 # Error login route
-@app.route("/errorLogin")
+@bp.route("/errorLogin")
+@pages.cached_page('errorLogin.html')
 def errorLogin():
     return render_template("errorLogin.html")
 
-google_bp = make_google_blueprint(
-    client_id=os.getenv("Client_ID"),
-    client_secret=os.getenv("Client_Secret"),
-    redirect_to="homepage",
-    scope=[
-        "openid",
-        "https://www.googleapis.com/auth/userinfo.profile",
-        "https://www.googleapis.com/auth/userinfo.email"
-    ]
-)
-app.register_blueprint(google_bp, url_prefix="/login")
-
 # --- Flask-Dance & OAuth setup notes ---
 # 1. .env file must have no spaces around '=' and no quotes around values.
 #    Example:
 #    Client_ID=your-client-id
 #    Client_Secret=your-client-secret
 # 2. If you get 'redirect_uri_mismatch', add BOTH http://localhost:5000/login/google/authorized AND http://127.0.0.1:5000/login/google/authorized to Google Cloud Console.
-# 3. Use endpoint name (not URL) for redirect_to, e.g. 'homepage' for @app.route('/')
+# 3. Use endpoint name (not URL) for redirect_to, e.g. 'main.homepage' for @bp.route('/')
 # 4. Always restart Flask after changing .env or Google settings.
 # 5. If you get 'invalid_client', double-check your client ID/secret and .env formatting.
 # 6. For local development, Google treats 'localhost' and '127.0.0.1' as different, so add both as redirect URIs.
@@ -154,13 +219,12 @@ app.register_blueprint(google_bp, url_prefix="/login")
 # These comments are for future reference and learning. You can always revisit them if you encounter similar issues.
 
 # Homepage endpoint
-@app.route('/')
+@bp.route('/')
 def homepage():
     logged_in = bool(session.get("google_oauth_token"))
     if logged_in and not session.get('couple_id'):
         # Get user info from Google
-        resp = google.get("/oauth2/v2/userinfo")
-        email = resp.json().get("email")
+        email = get_userinfo().get("email")
         couple_id = get_or_create_couple(email)
         session['couple_id'] = couple_id
         session['user_email'] = email
@@ -168,37 +232,33 @@ def homepage():
     couple_id = session.get('couple_id')
     partner_email = None
     if couple_id:
-        conn = sqlite3.connect('couples.db')
-        c = conn.cursor()
-        c.execute('SELECT user2_email FROM couples WHERE id=?', (couple_id,))
-        row = c.fetchone()
-        partner_email = row[0] if row and row[0] else None
-        conn.close()
-
-    features = [
+        partner_email = get_couple(couple_id)[1]
+
+    # The feature cards are the same for everyone, so they are rendered once.
+    features_html = pages.fragment('home_features.html', context=lambda: {'features': [
         {
             "title": "Gallery",
             "desc": "Upload and view pictures with notes as flashcards.",
-            "link": url_for('gallery')
+            "link": url_for('main.gallery')
         },
         {
             "title": "Words Together",
             "desc": "Share and view messages with your partner.",
-            "link": url_for('words_together')
+            "link": url_for('main.words_together')
         },
-      
-    ]
-    return render_template(
+    ]})
+    return pages.conditional(render_template(
         'index.html',
         logged_in=logged_in,
-        features=features,
+        features_html=features_html,
         partner_email=partner_email,
         couple_id=couple_id
-    )
+    ))
 
 # "Will You Be My Girlfriend" endpoint
-@app.route('/ask-girl', methods=['GET', 'POST'])
+@bp.route('/ask-girl', methods=['GET', 'POST'])
 @login_required
+@pages.cached_page('ask_girlfriend.html')
 def ask_girlfriend():
     show_animation = False
     response = None
@@ -215,8 +275,9 @@ def ask_girlfriend():
     return render_template('ask_girlfriend.html', response=response, show_animation=show_animation)
 
 # "Will You Be My Boyfriend" endpoint
-@app.route('/ask-boyfriend', methods=['GET', 'POST'])
+@bp.route('/ask-boyfriend', methods=['GET', 'POST'])
 @login_required
+@pages.cached_page('ask_boyfriend.html')
 def ask_boyfriend():
     show_animation = False
     response = None
@@ -235,74 +296,314 @@ def ask_boyfriend():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads are private to their couple and only reachable through /media/.
+# They are kept in storage.current(): UPLOAD_FOLDER, or a bucket when
+# STORAGE_URL is set (see storage.py).
+UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+# Where they used to live, world-readable through the static route.
+LEGACY_UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
+MEDIA_MAX_AGE = 365 * 24 * 3600  # stored names never change content
+
+@bp.app_template_global()
+def upload_url(filename):
+    return url_for('main.media_file', filename=filename)
+
+@bp.app_template_global()
+def derivative_url(content_hash, variant):
+    return upload_url(media.derivative_name(content_hash, variant))
+
+def move_legacy_uploads(upload_folder):
+    if upload_folder != UPLOAD_FOLDER or not os.path.isdir(LEGACY_UPLOAD_FOLDER):
+        return
+    os.makedirs(upload_folder, exist_ok=True)
+    for entry in os.listdir(LEGACY_UPLOAD_FOLDER):
+        dest = os.path.join(upload_folder, entry)
+        if not os.path.exists(dest):
+            try:
+                os.rename(os.path.join(LEGACY_UPLOAD_FOLDER, entry), dest)
+            except FileNotFoundError:
+                pass  # another worker moved it first
+    try:
+        os.rmdir(LEGACY_UPLOAD_FOLDER)
+    except OSError:
+        current_app.logger.warning('%s is not empty; files left there are still public.', LEGACY_UPLOAD_FOLDER)
+
+def can_read_media(filename, couple_id):
+    if re.fullmatch(invitations.SUBDIR + r'/(?:[0-9a-f]{2}/[0-9a-f]{2}/)?[0-9a-f]{64}\.[a-z]+', filename):
+        return True  # invitation cards are shared by prompt, see invitations.py
+    content_hash = media.content_hash_of(filename)
+    if content_hash:
+        row = db.query_one('SELECT 1 FROM images WHERE couple_id=? AND content_hash=? LIMIT 1', (couple_id, content_hash))
+    else:
+        row = db.query_one('SELECT 1 FROM images WHERE couple_id=? AND filename=? LIMIT 1', (couple_id, filename))
+    return row is not None
 
-@app.route('/gallery', methods=['GET', 'POST'])
+@bp.route('/media/<path:filename>')
 @login_required
+def media_file(filename):
+    # Only the couple that owns a photo can fetch it. By default werkzeug
+    # streams the file through wsgi.file_wrapper (sendfile under gunicorn)
+    # and answers Range, If-None-Match and If-Modified-Since itself.
+    # Behind nginx, set MEDIA_ACCEL_PREFIX to an internal location aliased
+    # to UPLOAD_FOLDER and the proxy sends the bytes; USE_X_SENDFILE=True
+    # does the same for Apache/lighttpd. With S3 storage the browser is
+    # redirected to a presigned URL and fetches the bytes from the bucket.
+    root = current_app.config['UPLOAD_FOLDER']
+    if safe_join(root, filename) is None or not can_read_media(filename, session.get('couple_id')):
+        abort(404)
+    presigned_url = storage.current().url(filename)
+    if presigned_url:
+        response = redirect(presigned_url)
+        # Reused by the browser while the signature is still valid.
+        response.headers['Cache-Control'] = f'private, max-age={storage.URL_EXPIRES // 2}'
+        return response
+    accel_prefix = current_app.config['MEDIA_ACCEL_PREFIX']
+    if accel_prefix:
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+    else:
+        # Stored files are never rewritten, so the name is a strong ETag.
+        response = send_from_directory(root, filename, max_age=MEDIA_MAX_AGE, etag=os.path.basename(filename))
+    response.headers['Cache-Control'] = f'private, max-age={MEDIA_MAX_AGE}, immutable'
+    return response
+
+@bp.route('/gallery', methods=['GET', 'POST'])
+@login_required
+@ratelimit.limit('uploads')
 def gallery():
     error = None
     couple_id = session.get('couple_id')
     if request.method == 'POST':
         if 'delete_id' in request.form:
-            delete_image(request.form['delete_id'])
-            return redirect(url_for('gallery'))
-        images = get_images(couple_id)
-        if len(images) >= 10:
-            error = 'Maximum of 10 images allowed.'
+            delete_image(request.form['delete_id'], couple_id)
+            return redirect(url_for('main.gallery'))
+        # Only spares ingesting a file that cannot be added; add_image()
+        # enforces the quota.
+        max_images = current_app.config['GALLERY_MAX_IMAGES']
+        if quotas.usage(couple_id, 'images') >= max_images:
+            error = f'Maximum of {max_images} images allowed.'
         else:
             file = request.files.get('image')
             note = request.form.get('note')
             if file and allowed_file(file.filename):
-                filename = secrets.token_hex(8) + '_' + file.filename
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                add_image(filename, note, couple_id)
-                return redirect(url_for('gallery'))  # <--- This is correct!
+                try:
+                    filename, content_hash = media.ingest(file.stream, storage.current())
+                except media.InvalidImage as e:
+                    error = str(e)
+                else:
+                    try:
+                        add_image(filename, note, couple_id, content_hash)  # derivatives are made in the background
+                    except quotas.QuotaExceeded as e:
+                        error = str(e)
+                    else:
+                        return redirect(url_for('main.gallery'))  # <--- This is correct!
             else:
                 error = 'Invalid file type.'
-    images = get_images(couple_id)
-    return render_template('Gallery.html', images=images, error=error)
+    # Cached until the next upload/delete; the revision keeps other workers in step.
+    images_html = pages.fragment(
+        'gallery_grid.html', (couple_id, get_feed_state(couple_id, 'images')[0]),
+        tags=[('images', couple_id)], context=lambda: {'images': get_images(couple_id)}
+    )
+    return pages.conditional(render_template('Gallery.html', images_html=images_html, error=error))
 
 # WordsTogether text sharing route
-@app.route('/words-together', methods=['GET', 'POST'])
+@bp.route('/words-together', methods=['GET', 'POST'])
 @login_required
+@ratelimit.limit('words')
 def words_together():
     error = None
     couple_id = session.get('couple_id')
     if request.method == 'POST':
         if 'delete_id' in request.form:
-            delete_word(request.form['delete_id'])
-            return redirect(url_for('words_together'))
+            delete_word(request.form['delete_id'], couple_id)
+            return redirect(url_for('main.words_together'))
         text = request.form.get('text')
         if text and len(text.strip()) > 0:
             add_word(text.strip(), couple_id, session['user_email'])
-            return redirect(url_for('words_together'))
+            return redirect(url_for('main.words_together'))
         else:
             error = 'Text cannot be empty.'
-    words = get_words(couple_id)
-    return render_template('WordsTogether.html', words=words, error=error)
+    current_user_email = session.get('user_email')
+    words_html = pages.fragment(
+        'words_list.html', (couple_id, get_feed_state(couple_id, 'words')[0], current_user_email),
+        tags=[('words', couple_id)],
+        context=lambda: {'words': get_words(couple_id), 'current_user_email': current_user_email}
+    )
+    return pages.conditional(render_template(
+        'WordsTogether.html', words_html=words_html, error=error, current_user_email=current_user_email
+    ))
+
+# --- JSON feed API ---
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+def feed_page(feed, fetch, serialize):
+    # ?before=<last seen id>&limit=<n>. The ETag covers the feed revision and
+    # the requested page, so an unchanged feed is answered with a 304 before
+    # any rows are read.
+    couple_id = session.get('couple_id')
+    before = request.args.get('before', type=int)
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    revision, updated_at = get_feed_state(couple_id, feed)
+    etag = f'{feed}-{couple_id}-{revision}-{before or 0}-{limit}'
+    last_modified = None
+    if updated_at:
+        last_modified = datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        rows = fetch(couple_id, before=before, limit=limit)
+        response = jsonify(
+            items=[serialize(row) for row in rows],
+            next_before=rows[-1][0] if len(rows) == limit else None
+        )
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
-@app.route("/login")
+@bp.route('/api/words')
+@login_required
+def api_words():
+    return feed_page('words', get_words, word_json)
+
+BULK_MAX_WORDS = 500
+
+@bp.route('/api/words', methods=['POST'])
+@login_required
+@ratelimit.limit('words')
+def api_add_words():
+    # {"texts": ["...", ...]}: many messages in one request and one write,
+    # e.g. a client replaying what it queued while offline. All of them are
+    # stored or, on a 400, none.
+    texts = (request.get_json(silent=True) or {}).get('texts')
+    if (not isinstance(texts, list) or not 0 < len(texts) <= BULK_MAX_WORDS
+            or not all(isinstance(text, str) and text.strip() for text in texts)):
+        return jsonify(error=f'texts must be a list of 1 to {BULK_MAX_WORDS} non-empty strings.'), 400
+    texts = [text.strip() for text in texts]
+    sender_email = session['user_email']
+    word_ids = add_words(texts, session.get('couple_id'), sender_email)
+    return jsonify(items=[word_json(row) for row in zip(word_ids, texts, [sender_email] * len(texts))]), 201
+
+def word_json(row):
+    return {'id': row[0], 'text': row[1], 'sender': row[2]}
+
+def image_json(row):
+    return {
+        'id': row[0],
+        'url': upload_url(row[1]),
+        'thumb_url': derivative_url(row[3], 'thumb') if row[4] else None,
+        'medium_url': derivative_url(row[3], 'medium') if row[4] else None,
+        'note': row[2]
+    }
+
+SSE_HEARTBEAT = 15  # seconds between keep-alive comments on an idle stream
+# Each open stream holds a server thread, so a worker only keeps a few
+# (SSE_MAX_STREAMS, half of gunicorn's default THREADS) and ends each after
+# SSE_MAX_AGE seconds; the browser reconnects on its own and Last-Event-ID
+# replays what it missed. A page turned away retries after SSE_BUSY_RETRY.
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '4'))
+SSE_MAX_AGE = int(os.getenv('SSE_MAX_AGE', '300'))
+SSE_BUSY_RETRY = 30  # seconds
+stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def sse(event):
+    lines = f'event: {event["type"]}\n'
+    if event['type'] == 'add':
+        lines += f'id: {event["id"]}\n'
+    return lines + f'data: {json.dumps(event)}\n\n'
+
+@bp.route('/api/words/stream')
+@login_required
+def api_words_stream():
+    # Server-Sent Events: one long-lived response per open page carrying
+    # only the deltas. A reconnecting EventSource sends Last-Event-ID and
+    # gets the words it missed replayed first.
+    couple_id = session.get('couple_id')
+    last_id = request.headers.get('Last-Event-ID', type=int)
+
+    def stream():
+        # Runs after the request context is gone: the slot, subscription and
+        # pooled connection are only taken once the response is being sent,
+        # so the finally below always gives them back.
+        if not stream_slots.acquire(blocking=False):
+            yield f'retry: {SSE_BUSY_RETRY * 1000}\n\n'
+            return
+        sub = hub.subscribe(couple_id)
+        try:
+            yield 'retry: 3000\n\n'
+            if last_id:
+                missed = db.query(
+                    'SELECT id, text, sender_email FROM words WHERE couple_id=? AND id>? ORDER BY id',
+                    (couple_id, last_id)
+                )
+                for word_id, text, sender in missed:
+                    yield sse({'type': 'add', 'id': word_id, 'text': text, 'sender': sender})
+            deadline = time.monotonic() + SSE_MAX_AGE
+            while time.monotonic() < deadline:
+                event = sub.get(timeout=min(SSE_HEARTBEAT, max(0, deadline - time.monotonic())))
+                yield sse(event) if event else ': keep-alive\n\n'
+        finally:
+            sub.close()
+            stream_slots.release()
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+@bp.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    job = jobs.get_job(job_id, session.get('couple_id'))
+    if job is None:
+        abort(404)
+    # The stored error is a traceback for the logs, not for the couple.
+    body = {key: job[key] for key in ('id', 'kind', 'status', 'result', 'created_at', 'updated_at')}
+    if job['status'] == 'failed':
+        body['error'] = 'The job failed.'
+    return jsonify(body)
+
+@bp.route('/api/images')
+@login_required
+def api_images():
+    return feed_page('images', get_images, image_json)
+
+@bp.route('/api/search')
+@login_required
+def api_search():
+    # ?q=<text>&type=words|images&offset=<n>&limit=<n>. Results are ranked
+    # by relevance (see search.py); each item carries ``highlight``, the
+    # matched text as escaped HTML with the hits wrapped in <mark>.
+    kind = request.args.get('type', 'words')
+    serialize = {'words': word_json, 'images': image_json}.get(kind)
+    if serialize is None:
+        return jsonify(error="type must be 'words' or 'images'."), 400
+    text = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    rows, highlights = search.search(session.get('couple_id'), text, kind, limit=limit, offset=offset)
+    return jsonify(
+        items=[dict(serialize(row), highlight=highlight) for row, highlight in zip(rows, highlights)],
+        next_offset=offset + limit if len(rows) == limit and offset + limit < search.CANDIDATES else None
+    )
+
+@bp.route("/login")
 def login():
     return redirect(url_for("google.login"))
 
-@app.route("/profile")
+@bp.route("/profile")
 @login_required
 def profile():
-    resp = google.get("/oauth2/v2/userinfo")
-    email = resp.json().get("email")
+    email = get_userinfo().get("email")
     couple_id = get_or_create_couple(email)
     session['couple_id'] = couple_id
     session['user_email'] = email
 
-    # Get partner info from DB
-    conn = sqlite3.connect('couples.db')
-    c = conn.cursor()
-    c.execute('SELECT user1_email, user2_email FROM couples WHERE id=?', (couple_id,))
-    row = c.fetchone()
-    conn.close()
-    user1_email, user2_email = row if row else (None, None)
+    # Get partner info (cached)
+    user1_email, user2_email = get_couple(couple_id)
 
     return render_template(
         "profile.html",
@@ -313,87 +614,118 @@ def profile():
     )
 
 # Logout route for Google OAuth
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     # Remove the OAuth token from the session
     if "google_oauth_token" in session:
         del session["google_oauth_token"]
     session.clear()  # Clear all session data
-    return redirect(url_for("homepage"))  # Redirect to homepage after logout
-
-# --- Couples database setup ---
-def init_couples_db():
-    conn = sqlite3.connect('couples.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS couples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user1_email TEXT NOT NULL,
-            user2_email TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Call this function at startup
-init_couples_db()
+    return redirect(url_for("main.homepage"))  # Redirect to homepage after logout
+
+# --- Couples ---
+# Couple rows and the email -> couple_id mapping are read on nearly every
+# page, so they are cached; every write to couples must go through the
+# helpers below so the cache is invalidated. That only reaches the worker
+# process making the change unless CACHE_URL=redis://... is set, so entries
+# also expire after COUPLE_CACHE_TTL seconds: no other worker keeps a
+# removed partner in the couple for longer than that.
+CACHE_URL = redisclient.setting_url('CACHE_URL')
+COUPLE_CACHE_TTL = int(os.getenv('COUPLE_CACHE_TTL', '30'))
+couple_cache = cache.make_cache(CACHE_URL, prefix='couplecenter:couple:', max_entries=10000, ttl=COUPLE_CACHE_TTL)
+# Google userinfo responses, keyed on a hash of the OAuth access token.
+userinfo_cache = cache.make_cache(CACHE_URL, prefix='couplecenter:userinfo:', max_entries=10000, ttl=600)
+
+def get_userinfo():
+    token = session.get('google_oauth_token') or {}
+    access_token = token.get('access_token')
+    key = hashlib.sha256(access_token.encode()).hexdigest() if access_token else None
+    info = userinfo_cache.get(key) if key else None
+    if info is None:
+        with metrics.timed('google', 'userinfo'):
+            # USERINFO_PROVIDER(token) replaces the Google call in benchmarks
+            provider = current_app.config.get('USERINFO_PROVIDER')
+            if provider:
+                info, ok = provider(token), True
+            else:
+                response = google.get("/oauth2/v2/userinfo")
+                info, ok = response.json(), response.ok
+        # Errors (an expired token, say) are asked again next time, not replayed.
+        if key and ok and info.get('email'):
+            expires_in = token.get('expires_in')
+            userinfo_cache.set(key, info, ttl=min(600, expires_in) if expires_in else None)
+    return info
+
+def get_couple(couple_id):
+    """Returns (user1_email, user2_email), or (None, None) for an unknown couple."""
+    couple = couple_cache.get(f'id:{couple_id}')
+    if couple is None:
+        row = db.query_one('SELECT user1_email, user2_email FROM couples WHERE id=?', (couple_id,))
+        couple = list(row) if row else [None, None]
+        couple_cache.set(f'id:{couple_id}', couple)
+    return tuple(couple)
 
 def get_or_create_couple(email):
-    conn = sqlite3.connect('couples.db')
-    c = conn.cursor()
+    couple_id = couple_cache.get(f'email:{email}')
+    if couple_id is not None:
+        return couple_id
     # Check if email is already user1 or user2
-    c.execute('SELECT id FROM couples WHERE user1_email=? OR user2_email=?', (email, email))
-    row = c.fetchone()
+    row = db.query_one('SELECT id FROM couples WHERE user1_email=? OR user2_email=?', (email, email))
     if row:
         couple_id = row[0]
     else:
         # Create new couple with user1_email
-        c.execute('INSERT INTO couples (user1_email) VALUES (?)', (email,))
-        couple_id = c.lastrowid
-        conn.commit()
-    conn.close()
+        couple_id = db.execute('INSERT INTO couples (user1_email) VALUES (?)', (email,)).lastrowid
+    couple_cache.set(f'email:{email}', couple_id)
     return couple_id
 
+def invalidate_couple(couple_id, *emails):
+    couple_cache.delete(f'id:{couple_id}', *(f'email:{email}' for email in emails if email))
+
 def add_partner_to_couple(couple_id, partner_email):
-    conn = sqlite3.connect('couples.db')
-    c = conn.cursor()
-    c.execute('UPDATE couples SET user2_email=? WHERE id=?', (partner_email, couple_id))
-    conn.commit()
-    conn.close()
+    old_partner = get_couple(couple_id)[1]
+    db.execute('UPDATE couples SET user2_email=? WHERE id=?', (partner_email, couple_id))
+    invalidate_couple(couple_id, partner_email, old_partner)
+
+def remove_partner_from_couple(couple_id):
+    # Clears user2_email and queues the purge of the couple's shared data
+    # (rows and uploaded files), see purge_couple_data_job.
+    old_partner = get_couple(couple_id)[1]
+    with db.transaction() as conn:
+        conn.execute('UPDATE couples SET user2_email=NULL WHERE id=?', (couple_id,))
+        max_image_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM images WHERE couple_id=?', (couple_id,)).fetchone()[0]
+        max_word_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM words WHERE couple_id=?', (couple_id,)).fetchone()[0]
+        jobs.enqueue(
+            'purge_couple_data',
+            {'couple_id': couple_id, 'max_image_id': max_image_id, 'max_word_id': max_word_id},
+            couple_id, conn=conn
+        )
+    invalidate_couple(couple_id, old_partner)
 
 # --- Database migration to add couple_id to words table ---
 def update_partner_session(couple_id):
-    conn = sqlite3.connect('couples.db')
-    c = conn.cursor()
-    c.execute('SELECT user2_email FROM couples WHERE id=?', (couple_id,))
-    row = c.fetchone()
-    session['partner_email'] = row[0] if row and row[0] else None
-    conn.close()
-
-@app.route('/add-partner', methods=['POST'])
+    session['partner_email'] = get_couple(couple_id)[1]
+
+@bp.route('/add-partner', methods=['POST'])
 @login_required
+@ratelimit.limit('partner')
 def add_partner():
     partner_email = request.form.get('partner_email')
     couple_id = session.get('couple_id')
     if couple_id and partner_email:
         add_partner_to_couple(couple_id, partner_email)
         session['partner_email'] = partner_email  # <-- Set in session for template logic
-    return redirect(url_for('homepage'))
+    return redirect(url_for('main.homepage'))
 
-@app.route('/partner-management', methods=['GET', 'POST'])
+@bp.route('/partner-management', methods=['GET', 'POST'])
 @login_required
+@ratelimit.limit('partner')
 def partner_management():
     couple_id = session.get('couple_id')
     user_email = session.get('user_email')
     partner_email = None
 
-    # Fetch partner email from DB
-    conn = sqlite3.connect('couples.db')
-    c = conn.cursor()
-    c.execute('SELECT user1_email, user2_email FROM couples WHERE id=?', (couple_id,))
-    row = c.fetchone()
-    conn.close()
-    user1_email, user2_email = row if row else (None, None)
+    # Fetch partner email (cached)
+    user1_email, user2_email = get_couple(couple_id)
     if user_email == user1_email:
         partner_email = user2_email
     else:
@@ -401,27 +733,10 @@ def partner_management():
 
     # Remove partner logic
     if request.method == 'POST' and 'remove_partner' in request.form:
-        # Delete all shared data
-        conn = sqlite3.connect('gallery.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM images WHERE couple_id=?', (couple_id,))
-        conn.commit()
-        conn.close()
-
-        conn = sqlite3.connect('WordsTogether.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM words WHERE couple_id=?', (couple_id,))
-        conn.commit()
-        conn.close()
-
-        # Remove partner from couples table
-        conn = sqlite3.connect('couples.db')
-        c = conn.cursor()
-        c.execute('UPDATE couples SET user2_email=NULL WHERE id=?', (couple_id,))
-        conn.commit()
-        conn.close()
+        # Remove partner from couples table and delete all shared data
+        remove_partner_from_couple(couple_id)
         session['partner_email'] = None
-        return redirect(url_for('partner_management'))
+        return redirect(url_for('main.partner_management'))
 
     return render_template(
         'partner_management.html',
@@ -430,9 +745,47 @@ def partner_management():
         couple_id=couple_id
     )
 
+# --- Export / import (see archive.py) ---
+@bp.route('/export')
+@login_required
+def export_data():
+    couple_id = session.get('couple_id')
+    filename = f"couplecenter-{datetime.now(timezone.utc):%Y-%m-%d}.zip"
+    return Response(
+        # Not stream_with_context: the app context would pin one pooled
+        # connection for the whole download; each batch checks out its own.
+        archive.export_couple(couple_id, storage.current()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'private, no-store'}
+    )
+
+@bp.route('/import', methods=['POST'])
+@login_required
+@ratelimit.limit('import', json=True)
+def import_data():
+    # multipart upload with the archive in the "archive" field; werkzeug
+    # spools it to disk, so this route gets its own size limit.
+    request.max_content_length = current_app.config['IMPORT_MAX_CONTENT_LENGTH']
+    couple_id = session.get('couple_id')
+    upload = request.files.get('archive')
+    if upload is None:
+        return jsonify(error='Attach the archive as "archive".'), 400
+    try:
+        counts = archive.import_archive(
+            upload.stream, couple_id, storage.current(), add_image,
+            max_file_bytes=current_app.config['MAX_CONTENT_LENGTH'],
+            max_total_bytes=current_app.config['IMPORT_MAX_UNCOMPRESSED_LENGTH'],
+        )
+    except archive.InvalidArchive as e:
+        return jsonify(error=str(e)), 400
+    pages.invalidate('words', couple_id)
+    pages.invalidate('images', couple_id)
+    return jsonify(counts)
+
 # route for OurStory page
-@app.route('/our-story', methods=['GET', 'POST'])
+@bp.route('/our-story', methods=['GET', 'POST'])
 @login_required
+@pages.cached_page('our_story.html')
 def our_story():
     # Simple hardcoded story text for demonstration
     story_text = ("""07/30
@@ -451,27 +804,165 @@ I want to do a big thing to ask you out to do it the most special way but honest
 
 
 # route for generating invitation card using Replicate API
-@app.route('/generate-invitation', methods=['GET', 'POST'])
+# The model runs on the job workers (see invitations.py); the page gets a
+# job id back immediately and polls /api/invitations/<job_id>.
+DEFAULT_INVITATION_PROMPT = 'Romantic date night invitation card'
+
+def submit_invitation(prompt):
+    """Returns (image_url, job_id); a cached card needs no job at all."""
+    filename = invitations.cached_image(invitations.cache_key(prompt))
+    if filename:
+        return upload_url(filename), None
+    return None, invitations.submit(prompt, session.get('couple_id'), current_app.config['INVITATIONS_PER_DAY'])
+
+@bp.route('/generate-invitation', methods=['GET', 'POST'])
 @login_required
+@ratelimit.limit('invitations')
 def generate_invitation():
     image_url = None
+    job_id = None
     error = None
+    status, headers = 200, {}
     if request.method == 'POST':
-        prompt = request.form.get('prompt', 'Romantic date night invitation card')
+        prompt = request.form.get('prompt') or DEFAULT_INVITATION_PROMPT
         try:
-            # Generate a single image using Replicate (Stable Diffusion)
-            output = replicate.run(
-                "prunaai/flux.1-dev:970a966e3a5d8aa9a4bf13d395cf49c975dc4726e359f982fb833f9b100f75d5",
-                input={"prompt": prompt}
+            image_url, job_id = submit_invitation(prompt)
+        except quotas.QuotaExceeded as e:  # also TooManyInvitations
+            error = str(e)
+            status, headers = 429, {'Retry-After': str(e.retry_after)}
+    return render_template('generate_invitation.html', image_url=image_url, job_id=job_id, error=error), status, headers
+
+@bp.route('/api/invitations', methods=['POST'])
+@login_required
+@ratelimit.limit('invitations')
+def api_submit_invitation():
+    data = request.get_json(silent=True) or request.form
+    prompt = data.get('prompt') or DEFAULT_INVITATION_PROMPT
+    try:
+        image_url, job_id = submit_invitation(prompt)
+    except quotas.QuotaExceeded as e:  # also TooManyInvitations
+        return jsonify(status='rejected', error=str(e)), 429, {'Retry-After': str(e.retry_after)}
+    if image_url:
+        return jsonify(status='done', image_url=image_url)
+    return jsonify(status='queued', job_id=job_id, status_url=url_for('main.api_invitation_status', job_id=job_id)), 202
+
+@bp.route('/api/invitations/<int:job_id>')
+@login_required
+def api_invitation_status(job_id):
+    job = jobs.get_job(job_id, session.get('couple_id'))
+    if job is None or job['kind'] != 'generate_invitation':
+        abort(404)
+    body = {'status': job['status']}
+    if job['status'] == 'done':
+        body['image_url'] = upload_url(job['result']['filename'])
+    elif job['status'] == 'failed':
+        body['error'] = 'Error generating image. Try a different prompt.'
+    return jsonify(body)
+
+# --- Application factory ---
+def create_app(test_config=None):
+    """Build the Flask app.
+
+    Production servers load wsgi.py (see gunicorn.conf.py); ``python main.py``
+    runs the debug server. Settings come from the environment (SECRET_KEY,
+    DATABASE_PATH, JOB_WORKERS, ...) and can be overridden with test_config.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(
+        SECRET_KEY=os.getenv('SECRET_KEY'),
+        DATABASE_PATH=db.DATABASE_PATH,
+        UPLOAD_FOLDER=os.getenv('UPLOAD_FOLDER', UPLOAD_FOLDER),
+        MEDIA_ACCEL_PREFIX=os.getenv('MEDIA_ACCEL_PREFIX'),
+        MAX_CONTENT_LENGTH=25 * 1024 * 1024,  # larger uploads are rejected with 413
+        IMPORT_MAX_CONTENT_LENGTH=int(os.getenv('IMPORT_MAX_CONTENT_LENGTH', str(10 * 1024 ** 3))),
+        # Photos are stored uncompressed in archives; only the JSON lines expand.
+        IMPORT_MAX_UNCOMPRESSED_LENGTH=int(os.getenv('IMPORT_MAX_UNCOMPRESSED_LENGTH', str(12 * 1024 ** 3))),
+        MIGRATE_ON_START=os.getenv('MIGRATE_ON_START', '1') == '1',
+        JOB_WORKERS=jobs.WORKERS,
+        GALLERY_MAX_IMAGES=quotas.MAX_IMAGES,
+        INVITATIONS_PER_DAY=quotas.INVITATIONS_PER_DAY,
+        GROUP_COMMIT=writes.ENABLED,
+    )
+    if test_config:
+        app.config.update(test_config)
+
+    # Every worker must sign sessions with the same key, so a random one is
+    # only acceptable for the single-process debug server.
+    if not app.config['SECRET_KEY']:
+        if not (app.debug or app.testing):
+            raise RuntimeError('SECRET_KEY is not set; add it to .env or the environment.')
+        app.logger.warning('SECRET_KEY is not set; using a random key, sessions end on restart.')
+        app.config['SECRET_KEY'] = secrets.token_hex(16)
+
+    # gunicorn.conf.py exports the worker count. Each worker has its own
+    # caches unless they are shared through Redis.
+    if int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+        if not CACHE_URL:
+            app.logger.warning(
+                'Running %s workers without CACHE_URL: partner changes reach the other workers '
+                'only after COUPLE_CACHE_TTL (%ss).', os.getenv('WEB_CONCURRENCY'), COUPLE_CACHE_TTL
             )
-            # output is a list, but we only want the first image
-            if output and isinstance(output, list) and len(output) > 0:
-                image_url = output[0]
-            else:
-                error = "No image generated. Try a different prompt."
-        except Exception as e:
-            error = f"Error generating image: {str(e)}"
-    return render_template('generate_invitation.html', image_url=image_url, error=error)
+        if not PUBSUB_URL:
+            app.logger.warning(
+                'Running %s workers without PUBSUB_URL: open Words Together pages only see '
+                'messages posted through their own worker.', os.getenv('WEB_CONCURRENCY')
+            )
+
+    with app.app_context():
+        move_legacy_uploads(app.config['UPLOAD_FOLDER'])
+
+    db.configure(app.config['DATABASE_PATH'])
+    db.init_app(app)  # Return pooled connections at the end of each request
+    writes.configure(enabled=app.config['GROUP_COMMIT'])
+    if app.config['MIGRATE_ON_START']:
+        migrations.migrate()
+
+    CORS(app)  # Enable CORS for cross-origin requests
+    metrics.init_app(app)  # Per-route timings, /metrics and Server-Timing
+    assets.init_app(app)  # asset_url() and /assets/ with immutable caching
+    storage.init_app(app)  # UPLOAD_FOLDER, or the bucket in STORAGE_URL
+    ratelimit.init_app(app)  # 429s for @ratelimit.limit views
+    google_bp = make_google_blueprint(
+        client_id=os.getenv("Client_ID"),
+        client_secret=os.getenv("Client_Secret"),
+        redirect_to="main.homepage",
+        scope=[
+            "openid",
+            "https://www.googleapis.com/auth/userinfo.profile",
+            "https://www.googleapis.com/auth/userinfo.email"
+        ]
+    )
+    app.register_blueprint(google_bp, url_prefix="/login")
+    app.register_blueprint(bp)
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending database migrations."""
+        migrations.migrate()
+
+    @app.cli.command('import-legacy')
+    def import_legacy_command():
+        """Copy couples.db, WordsTogether.db and gallery.db into an empty database."""
+        with db.transaction() as conn:
+            migrations.import_legacy(conn)
+
+    @app.cli.command('search-backfill')
+    def search_backfill_command():
+        """Rebuild the full-text search index from the words and images tables."""
+        search.rebuild()
+
+    @app.cli.command('storage-upload')
+    def storage_upload_command():
+        """Copy every file in UPLOAD_FOLDER into the store set by STORAGE_URL."""
+        copied = storage.copy_tree(app.config['UPLOAD_FOLDER'], storage.current())
+        print(f'Copied {copied} file(s).')
+
+    jobs.init_app(app)
+    return app
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app({'DEBUG': True})
+    # With the reloader only the child process serves requests.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.start_for(app)
+    app.run(debug=True)
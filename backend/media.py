@@ -0,0 +1,156 @@
+"""Image ingestion for the gallery.
+
+Uploads are streamed to disk in chunks while being hashed, checked against
+their magic bytes, stripped of EXIF metadata and stored under their content
+hash, so the same photo uploaded twice is kept once::
+
+    ab/cd/abcd1234....jpg          original (metadata stripped)
+    ab/cd/abcd1234....thumb.webp   gallery card
+    ab/cd/abcd1234....medium.webp  larger screens
+
+The two hash-prefix levels shard the store (see storage.py) into 65,536
+directories. Legacy uploads keep their flat ``<token>_<name>`` filenames
+and have no derivatives.
+"""
+import hashlib
+import os
+import re
+
+from PIL import Image, ImageOps
+
+import storage
+
+CHUNK_SIZE = 64 * 1024
+MAX_PIXELS = 50_000_000  # refuse decompression bombs well before Pillow's own limit
+
+# Longest edge in pixels for each derivative.
+DERIVATIVES = {
+    'thumb': 320,
+    'medium': 1280,
+}
+WEBP_QUALITY = 80
+
+MAGIC_BYTES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def sniff_image_type(head):
+    """Return the extension matching the file's magic bytes, or None."""
+    for magic, ext in MAGIC_BYTES:
+        if head.startswith(magic):
+            return ext
+    return None
+
+
+def _shard(content_hash):
+    return os.path.join(content_hash[:2], content_hash[2:4])
+
+
+def blob_name(content_hash, ext):
+    return os.path.join(_shard(content_hash), f'{content_hash}.{ext}').replace(os.sep, '/')
+
+
+def derivative_name(content_hash, variant):
+    return os.path.join(_shard(content_hash), f'{content_hash}.{variant}.webp').replace(os.sep, '/')
+
+
+_STORED_NAME = re.compile(r'([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})\.(?:[a-z]+|[a-z]+\.webp)')
+
+
+def content_hash_of(name):
+    """The content hash behind a blob_name() or derivative_name(), or None."""
+    match = _STORED_NAME.fullmatch(name)
+    return match.group(3) if match else None
+
+
+def _store(store, name, write):
+    # Written to a staging file first and put() in one go, so readers never
+    # see a partially written file.
+    with storage.staged(store, suffix=os.path.splitext(name)[1]) as tmp_path:
+        write(tmp_path)
+        store.put(name, tmp_path)
+
+
+def _open(fp):
+    try:
+        image = Image.open(fp)
+        if image.width * image.height > MAX_PIXELS:
+            raise InvalidImage('Image is too large.')
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise InvalidImage('File is not a readable image.') from e
+    return image
+
+
+def ingest(stream, store):
+    """Put an uploaded image into ``store`` and return ``(filename, content_hash)``.
+
+    Raises InvalidImage if the bytes are not a PNG, JPEG or GIF whatever the
+    original filename claims. Derivatives are produced separately by
+    make_derivatives().
+    """
+    digest = hashlib.sha256()
+    head = b''
+    with storage.staged(store) as tmp_path:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+
+        ext = sniff_image_type(head)
+        if ext is None:
+            raise InvalidImage('Only PNG, JPEG and GIF images are allowed.')
+        content_hash = digest.hexdigest()
+        filename = blob_name(content_hash, ext)
+        if store.exists(filename):
+            return filename, content_hash  # already stored
+
+        with _open(tmp_path) as image:
+            if ext == 'gif':
+                # GIFs carry no EXIF; keep the bytes so animations survive.
+                image.close()
+                store.put(filename, tmp_path)
+            else:
+                icc_profile = image.info.get('icc_profile')
+                image = ImageOps.exif_transpose(image)  # bake in the orientation before dropping EXIF
+                save_options = {'icc_profile': icc_profile} if icc_profile else {}
+                if ext == 'jpg':
+                    save_options['quality'] = 95
+                _store(store, filename, lambda path: image.save(path, PIL_FORMATS[ext], **save_options))
+        return filename, content_hash
+
+
+def make_derivatives(store, filename, content_hash):
+    """Write the resized WebP derivatives for a stored original."""
+    with store.open(filename) as f, _open(f) as original:
+        image = original.convert('RGBA' if original.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    for variant, size in DERIVATIVES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        _store(
+            store, derivative_name(content_hash, variant),
+            lambda path: resized.save(path, 'WEBP', quality=WEBP_QUALITY, method=4)
+        )
+
+
+def remove_blob(store, filename, content_hash=None):
+    """Delete a stored original and, for content-addressed blobs, its derivatives."""
+    names = [filename]
+    if content_hash:
+        names += [derivative_name(content_hash, variant) for variant in DERIVATIVES]
+    for name in names:
+        store.delete(name)
@@ -0,0 +1,161 @@
+"""Request, SQL, template and outbound-call timings exported for Prometheus.
+
+init_app() times every request per route and serves the collected
+histograms at /metrics in the Prometheus text format. db.py reports every
+statement through observe_sql(), and calls to Google and Replicate are
+wrapped in timed(). With SERVER_TIMING=1 each response also carries a
+Server-Timing header with this request's share, visible in browser devtools.
+
+Metrics are kept per process: with several gunicorn workers each scrape
+sees the worker that answered it.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(key, list(series)) for key, series in items]
+        for label_values, series in items:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {series[-2]}')
+            lines.append(f'{self.name}_count{suffix} {series[-1]}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'couplecenter_request_duration_seconds', 'Time to produce a response, by route.',
+    ('method', 'route', 'status'))
+SQL_DURATION = Histogram(
+    'couplecenter_sql_duration_seconds', 'SQLite statement execution time, by statement type.',
+    ('operation',))
+TEMPLATE_DURATION = Histogram(
+    'couplecenter_template_render_seconds', 'Jinja template rendering time.',
+    ('template',))
+OUTBOUND_DURATION = Histogram(
+    'couplecenter_outbound_duration_seconds', 'Calls to external services (Google, Replicate).',
+    ('service', 'operation'))
+WRITE_BATCH_SIZE = Histogram(
+    'couplecenter_write_batch_size', 'Writes committed together by the group-commit writer.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+REGISTRY = [REQUEST_DURATION, SQL_DURATION, TEMPLATE_DURATION, OUTBOUND_DURATION, WRITE_BATCH_SIZE]
+
+
+def _add_to_request(name, seconds):
+    # Per-request totals for the Server-Timing header.
+    if has_request_context():
+        timings = g.setdefault('_timings', {})
+        total, count = timings.get(name, (0.0, 0))
+        timings[name] = (total + seconds, count + 1)
+
+
+def observe_sql(sql, seconds):
+    operation = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'UNKNOWN'
+    SQL_DURATION.observe(seconds, operation)
+    _add_to_request('db', seconds)
+
+
+@contextmanager
+def timed(service, operation):
+    """Time a call to an external service."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        OUTBOUND_DURATION.observe(seconds, service, operation)
+        _add_to_request(service, seconds)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def _record_request(response):
+    start = g.pop('_request_start', None)
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_DURATION.observe(seconds, request.method, route, response.status_code)
+    if g.get('_server_timing'):
+        entries = [f'app;dur={seconds * 1000:.1f}']
+        for name, (total, count) in g.get('_timings', {}).items():
+            entries.append(f'{name};dur={total * 1000:.1f};desc="{count} call(s)"')
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    g.setdefault('_template_starts', []).append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    starts = g.get('_template_starts')
+    if starts:
+        seconds = time.perf_counter() - starts.pop()
+        TEMPLATE_DURATION.observe(seconds, template.name or 'string')
+        _add_to_request('tpl', seconds)
+
+
+def init_app(app):
+    app.config.setdefault('SERVER_TIMING', os.getenv('SERVER_TIMING') == '1')
+    # When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>".
+    app.config.setdefault('METRICS_TOKEN', os.getenv('METRICS_TOKEN'))
+
+    @app.before_request
+    def start_timer():
+        g._request_start = time.perf_counter()
+        g._server_timing = app.config['SERVER_TIMING']
+
+    app.after_request(_record_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,268 @@
+"""Versioned schema migrations for the CoupleCenter database.
+
+Each migration runs once, in order, and bumps ``PRAGMA user_version`` in the
+same transaction. Add new migrations to the end of MIGRATIONS; never edit one
+that has already shipped.
+"""
+import os
+import sqlite3
+
+import db
+
+BACKEND_DIR = os.path.dirname(__file__)
+# Databases used before everything moved into one file. Their rows are copied
+# over the first time the default database is created; any other database
+# (tests, benchmarks, a DATABASE_PATH override) only gets them through
+# ``flask --app main import-legacy``.
+LEGACY_COUPLES_DB = os.path.join(BACKEND_DIR, 'couples.db')
+LEGACY_WORDS_DB = os.path.join(BACKEND_DIR, 'WordsTogether.db')
+LEGACY_GALLERY_DB = os.path.join(BACKEND_DIR, 'gallery.db')
+
+
+def _statements(script):
+    """Split a SQL script into statements (triggers may contain ``;``)."""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
+
+
+def _initial_schema(conn):
+    for statement in _statements('''
+        CREATE TABLE couples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_email TEXT NOT NULL,
+            user2_email TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX couples_user1_email ON couples (user1_email);
+        CREATE INDEX couples_user2_email ON couples (user2_email);
+
+        CREATE TABLE words (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            couple_id INTEGER NOT NULL REFERENCES couples (id) ON DELETE CASCADE,
+            text TEXT NOT NULL,
+            sender_email TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX words_couple_id ON words (couple_id, id DESC);
+
+        CREATE TABLE images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            couple_id INTEGER NOT NULL REFERENCES couples (id) ON DELETE CASCADE,
+            filename TEXT NOT NULL,
+            note TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX images_couple_id ON images (couple_id, id DESC);
+    '''):
+        conn.execute(statement)
+
+
+def _import_legacy_databases(conn):
+    if os.path.abspath(db.DATABASE_PATH) == os.path.abspath(db.DEFAULT_DATABASE_PATH):
+        import_legacy(conn)
+
+
+def import_legacy(conn):
+    """Copy the rows of the legacy databases into the empty database on ``conn``."""
+    if conn.execute('SELECT 1 FROM couples LIMIT 1').fetchone():
+        raise RuntimeError('The database already has couples; legacy rows would clash with their ids.')
+    # Rows without a matching couple were never visible to anyone, so they
+    # are left behind rather than breaking the foreign keys.
+    sources = (
+        (LEGACY_COUPLES_DB, 'couples',
+         'SELECT id, user1_email, user2_email FROM couples',
+         'INSERT INTO couples (id, user1_email, user2_email) VALUES (?, ?, ?)'),
+        (LEGACY_WORDS_DB, 'words',
+         'SELECT id, couple_id, text, sender_email FROM words',
+         'INSERT INTO words (id, couple_id, text, sender_email) '
+         'SELECT ?1, ?2, ?3, ?4 WHERE EXISTS (SELECT 1 FROM couples WHERE id=?2)'),
+        (LEGACY_GALLERY_DB, 'images',
+         'SELECT id, couple_id, filename, note FROM images',
+         'INSERT INTO images (id, couple_id, filename, note) '
+         'SELECT ?1, ?2, ?3, ?4 WHERE EXISTS (SELECT 1 FROM couples WHERE id=?2)'),
+    )
+    for path, table, select_sql, insert_sql in sources:
+        if not os.path.exists(path) or os.path.abspath(path) == os.path.abspath(db.DATABASE_PATH):
+            continue
+        legacy = sqlite3.connect(path)
+        try:
+            found = legacy.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+            ).fetchone()
+            if found:
+                conn.executemany(insert_sql, legacy.execute(select_sql))
+        finally:
+            legacy.close()
+
+
+def _feed_state(conn):
+    # One row per (couple, feed) bumped by triggers on every write, so the
+    # JSON API can answer conditional requests without reading the feed.
+    for statement in _statements('''
+        CREATE TABLE feed_state (
+            couple_id INTEGER NOT NULL,
+            feed TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (couple_id, feed)
+        ) WITHOUT ROWID;
+    ''' + ''.join(f'''
+        CREATE TRIGGER {table}_feed_{event} AFTER {event} ON {table} BEGIN
+            INSERT INTO feed_state (couple_id, feed, revision, updated_at)
+            VALUES ({row}.couple_id, '{table}', 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (couple_id, feed) DO UPDATE
+            SET revision = revision + 1, updated_at = excluded.updated_at;
+        END;
+    ''' for table in ('words', 'images')
+          for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')))):
+        conn.execute(statement)
+
+
+def _image_content_hash(conn):
+    # Uploads are stored by content hash (see media.py); several rows may
+    # share one blob, so deletes need to find the other references.
+    conn.execute('ALTER TABLE images ADD COLUMN content_hash TEXT')
+    conn.execute('ALTER TABLE images ADD COLUMN derivatives_ready INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX images_content_hash ON images (content_hash)')
+
+
+def _jobs(conn):
+    # Background job queue, see jobs.py. run_after/lease_until are unix times.
+    for statement in _statements('''
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            couple_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            result TEXT,
+            last_error TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX jobs_pending ON jobs (status, run_after) WHERE status IN ('queued', 'running');
+    '''):
+        conn.execute(statement)
+
+
+def _invitation_cache(conn):
+    # Generated invitation cards by (model, normalized prompt), see invitations.py.
+    conn.execute('''
+        CREATE TABLE invitation_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX invitation_cache_last_used ON invitation_cache (last_used)')
+
+
+def _search_index(conn):
+    # FTS5 indexes over message text and photo notes, see search.py. The
+    # couple_id column scopes every query; it is left out of the ranking.
+    for table, column in (('words', 'text'), ('images', 'note')):
+        for statement in _statements(f'''
+            CREATE VIRTUAL TABLE {table}_fts USING fts5 (
+                {column}, couple_id,
+                content='{table}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            );
+            INSERT INTO {table}_fts ({table}_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)');
+            CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_fts (rowid, {column}, couple_id) VALUES (NEW.id, NEW.{column}, NEW.couple_id);
+            END;
+            CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, {column}, couple_id)
+                VALUES ('delete', OLD.id, OLD.{column}, OLD.couple_id);
+            END;
+            CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {column}, couple_id ON {table} BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, {column}, couple_id)
+                VALUES ('delete', OLD.id, OLD.{column}, OLD.couple_id);
+                INSERT INTO {table}_fts (rowid, {column}, couple_id) VALUES (NEW.id, NEW.{column}, NEW.couple_id);
+            END;
+            -- Backfill existing rows.
+            INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild');
+        '''):
+            conn.execute(statement)
+
+
+def _quota_usage(conn):
+    # Per-couple counters checked by quotas.py inside the writing transaction.
+    # 'images' is kept in step with the images table by triggers; windowed
+    # quotas such as 'invitations' restart counting when ``period`` changes.
+    for statement in _statements('''
+        CREATE TABLE quota_usage (
+            couple_id INTEGER NOT NULL,
+            quota TEXT NOT NULL,
+            period TEXT NOT NULL DEFAULT '',
+            used INTEGER NOT NULL,
+            PRIMARY KEY (couple_id, quota)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER images_quota_insert AFTER INSERT ON images BEGIN
+            INSERT INTO quota_usage (couple_id, quota, used) VALUES (NEW.couple_id, 'images', 1)
+            ON CONFLICT (couple_id, quota) DO UPDATE SET used = used + 1;
+        END;
+        CREATE TRIGGER images_quota_delete AFTER DELETE ON images BEGIN
+            UPDATE quota_usage SET used = used - 1 WHERE couple_id = OLD.couple_id AND quota = 'images';
+        END;
+        CREATE TRIGGER images_quota_update AFTER UPDATE OF couple_id ON images BEGIN
+            UPDATE quota_usage SET used = used - 1 WHERE couple_id = OLD.couple_id AND quota = 'images';
+            INSERT INTO quota_usage (couple_id, quota, used) VALUES (NEW.couple_id, 'images', 1)
+            ON CONFLICT (couple_id, quota) DO UPDATE SET used = used + 1;
+        END;
+        -- Backfill existing rows.
+        INSERT INTO quota_usage (couple_id, quota, used)
+        SELECT couple_id, 'images', COUNT(*) FROM images GROUP BY couple_id;
+    '''):
+        conn.execute(statement)
+
+
+MIGRATIONS = [
+    _initial_schema,
+    _import_legacy_databases,
+    _feed_state,
+    _image_content_hash,
+    _jobs,
+    _invitation_cache,
+    _search_index,
+    _quota_usage,
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate():
+    """Bring the database up to the latest schema version.
+
+    Each step takes the write lock and re-checks the version, so several
+    processes starting at once apply every migration exactly once.
+    """
+    with db.connection() as conn:
+        conn.commit()
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if current_version(conn) >= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if current_version(conn) < version:
+                    migration(conn)
+                    conn.execute(f'PRAGMA user_version={version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
@@ -0,0 +1,157 @@
+"""Rendered HTML kept between requests.
+
+cached_page() memoizes whole GET responses of views whose output only
+depends on their template (Our Story, the ask pages, errorLogin), keyed by
+route, template mtime, asset bundle versions and any session fields the
+page shows. fragment() does the same for a piece of a page, such as the
+homepage feature cards or the Words Together message list.
+
+Entries live in one per-process LRU bounded by total size
+(PAGE_CACHE_BYTES). Responses carry a strong ETag over the body, so a
+browser revalidating an unchanged page gets a 304.
+
+Fragments built from a couple's feed are tagged ('words', couple_id) or
+('images', couple_id); the write paths in main.py call invalidate() so the
+next view renders fresh rows. Their keys also include the feed revision
+(see migrations._feed_state), so other worker processes, which never see
+that call, do not serve stale lists either.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from flask import current_app, render_template, request, session
+from markupsafe import Markup
+
+PAGE_CACHE_BYTES = int(os.getenv('PAGE_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+
+class FragmentCache:
+    """LRU of rendered strings bounded by their total length, with tags."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()  # key -> (value, tags)
+        self._tags = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, tags=()):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, tags)
+            self.size += len(value)
+            for tag in tags:
+                self._tags[tag].add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in self._tags.pop(tag, ()):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        value, tags = entry
+        self.size -= len(value)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+_cache = FragmentCache(PAGE_CACHE_BYTES)
+
+
+def invalidate(*tag):
+    """Drop every fragment tagged ``tag``, e.g. invalidate('words', couple_id)."""
+    _cache.invalidate(tag)
+
+
+def _template_version(name):
+    template = current_app.jinja_env.get_template(name)
+    return os.path.getmtime(template.filename) if template.filename else None
+
+
+def _assets_version():
+    state = current_app.extensions.get('assets')
+    return tuple(sorted(state['manifest'].items())) if state else None
+
+
+def _etag(body):
+    return hashlib.sha256(body.encode()).hexdigest()[:32]
+
+
+def conditional(body):
+    """HTML response with a strong ETag, answered with 304 when unchanged."""
+    response = current_app.response_class(body, mimetype='text/html')
+    response.set_etag(_etag(body))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def fragment(template, key=(), tags=(), context=None):
+    """Render ``template`` once per ``key`` and template version.
+
+    ``context`` is a callable returning the template variables; it only
+    runs on a miss, so the queries behind a cached fragment are skipped too.
+    """
+    if not current_app.config.get('PAGE_CACHE', True):
+        return Markup(render_template(template, **(context() if context else {})))
+    cache_key = ('fragment', template, _template_version(template)) + tuple(key)
+    html = _cache.get(cache_key)
+    if html is None:
+        html = render_template(template, **(context() if context else {}))
+        _cache.set(cache_key, html, tags)
+    return Markup(html)
+
+
+def cached_page(template, session_fields=()):
+    """Serve a view's GET responses from the cache.
+
+    Only for views whose HTML is fully determined by ``template`` and the
+    listed session fields; other methods always run the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or not current_app.config.get('PAGE_CACHE', True):
+                return view(*args, **kwargs)
+            cache_key = (
+                'page', request.endpoint, tuple(sorted(kwargs.items())),
+                _template_version(template), _assets_version(),
+                tuple(session.get(field) for field in session_fields),
+            )
+            body = _cache.get(cache_key)
+            if body is None:
+                body = view(*args, **kwargs)
+                if not isinstance(body, str):
+                    return body
+                _cache.set(cache_key, body)
+            return conditional(body)
+        return wrapper
+    return decorator
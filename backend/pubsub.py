@@ -0,0 +1,111 @@
+"""Publish/subscribe hub for pushing per-couple updates to open pages.
+
+The write paths publish small delta events (``{'type': 'add', ...}``) keyed
+by couple_id and every subscriber for that couple receives them. LocalHub
+fans out inside one process; RedisHub goes through any Redis-compatible
+server so events reach subscribers held by other worker processes.
+"""
+import json
+import queue
+import threading
+from collections import defaultdict
+
+import redisclient
+
+# Sent to a subscriber that fell too far behind and lost events; the client
+# should reload the feed instead of applying deltas.
+RESET = {'type': 'reset'}
+
+
+class Subscription:
+    def __init__(self, hub, couple_id, max_pending):
+        self.hub = hub
+        self.couple_id = couple_id
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lost = False
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._lost = True
+
+    def get(self, timeout=None):
+        """Return the next event, or None if nothing arrived within ``timeout``."""
+        if self._lost:
+            self._lost = False
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            return RESET
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LocalHub:
+    """In-process hub: subscribers are plain queues keyed by couple_id."""
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, couple_id):
+        sub = Subscription(self, couple_id, self.max_pending)
+        with self._lock:
+            self._subscribers[couple_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.couple_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.couple_id]
+
+    def publish(self, couple_id, event):
+        with self._lock:
+            subs = list(self._subscribers.get(couple_id, ()))
+        for sub in subs:
+            sub.put(event)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub, channel):
+        self._pubsub = pubsub
+        self._pubsub.subscribe(channel)
+
+    def get(self, timeout=None):
+        message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+        if message is None:
+            return None
+        return json.loads(message['data'])
+
+    def close(self):
+        self._pubsub.close()
+
+
+class RedisHub:
+    """Hub backed by Redis PUBLISH/SUBSCRIBE, shared by every worker process."""
+
+    def __init__(self, url, prefix='couplecenter:couple:'):
+        self._redis = redisclient.client(url)
+        self.prefix = prefix
+
+    def subscribe(self, couple_id):
+        return RedisSubscription(self._redis.pubsub(), f'{self.prefix}{couple_id}')
+
+    def publish(self, couple_id, event):
+        self._redis.publish(f'{self.prefix}{couple_id}', json.dumps(event))
+
+
+def make_hub(url=None):
+    """LocalHub by default; a RedisHub when given a ``redis://`` URL."""
+    if url:
+        return RedisHub(url)
+    return LocalHub()
@@ -0,0 +1,72 @@
+"""Per-couple quotas enforced by the database.
+
+Usage is kept in the quota_usage table (see migrations._quota_usage) and
+checked inside the transaction that does the write, so concurrent requests
+cannot all slip under a limit the way a count taken beforehand lets them:
+
+``images``
+    Photos in the gallery (GALLERY_MAX_IMAGES). Triggers count every insert
+    and delete; check_images() runs right after the INSERT and rolls it back
+    when the couple is over the limit.
+
+``invitations``
+    Invitation cards sent to Replicate per UTC day (INVITATIONS_PER_DAY).
+    consume_daily() adds one in a single conditional upsert.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import db
+
+MAX_IMAGES = int(os.getenv('GALLERY_MAX_IMAGES', '10'))
+INVITATIONS_PER_DAY = int(os.getenv('INVITATIONS_PER_DAY', '20'))
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until the quota resets, if it does
+
+
+def usage(couple_id, quota, period=''):
+    """Current count; for a quick check before expensive work, not for enforcement."""
+    row = db.query_one(
+        'SELECT used FROM quota_usage WHERE couple_id=? AND quota=? AND period=?', (couple_id, quota, period)
+    )
+    return row[0] if row else 0
+
+
+def check_images(conn, couple_id, limit=MAX_IMAGES):
+    """Raise QuotaExceeded if the insert just made on ``conn`` went over ``limit``."""
+    used = conn.execute(
+        "SELECT used FROM quota_usage WHERE couple_id=? AND quota='images'", (couple_id,)
+    ).fetchone()[0]
+    if used > limit:
+        raise QuotaExceeded(f'Maximum of {limit} images allowed.')
+
+
+def today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def seconds_until_tomorrow():
+    now = datetime.now(timezone.utc)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+    return int((tomorrow - now).total_seconds()) + 1
+
+
+def consume_daily(conn, couple_id, quota, limit):
+    """Count one use of ``quota`` today, or raise QuotaExceeded.
+
+    The counter restarts at the first use on a new day. Check and increment
+    are one statement, so it is atomic even outside a transaction.
+    """
+    period = today()
+    cur = conn.execute('''
+        INSERT INTO quota_usage (couple_id, quota, period, used) VALUES (?1, ?2, ?3, 1)
+        ON CONFLICT (couple_id, quota) DO UPDATE
+        SET used = CASE WHEN period = ?3 THEN used + 1 ELSE 1 END, period = ?3
+        WHERE period != ?3 OR used < ?4
+    ''', (couple_id, quota, period, limit))
+    if not cur.rowcount:
+        raise QuotaExceeded(f'Daily limit of {limit} reached, try again tomorrow.', seconds_until_tomorrow())
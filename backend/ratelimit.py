@@ -0,0 +1,168 @@
+"""Token-bucket rate limits per couple and route.
+
+Views opt in with a named limit::
+
+    @bp.route('/add-partner', methods=['POST'])
+    @login_required
+    @ratelimit.limit('partner')
+    def add_partner():
+        ...
+
+Each (limit, couple) pair has a bucket of ``burst`` tokens refilled at
+``rate`` per second; a request takes one and, when the bucket is empty, is
+answered 429 with Retry-After set to when the next token arrives. Requests
+without a couple are counted per client address. Only writes (POST by
+default) are limited; the pages themselves are cheap and cached.
+
+Buckets live in process memory, so with several gunicorn workers each allows
+the full rate. Set RATELIMIT_URL (or REDIS_URL) to redis://... to share
+them between every worker and host. Limits can be changed with the RATE_LIMITS setting
+(name -> (rate, burst)) and switched off with RATELIMIT_ENABLED=0.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, jsonify, request, session
+from werkzeug.exceptions import TooManyRequests
+
+import redisclient
+
+# name -> (tokens per second, burst)
+LIMITS = {
+    'words': (5, 30),                  # messages, also bulk requests
+    'uploads': (0.5, 10),              # gallery uploads and deletes
+    'partner': (10 / 3600, 5),         # partner changes
+    'invitations': (10 / 3600, 3),     # AI invitation cards, each a Replicate call
+    'import': (2 / 3600, 2),           # archive imports
+}
+MAX_BUCKETS = 100_000  # least recently used buckets are dropped, i.e. refilled
+
+
+class LocalLimiter:
+    """Buckets in this process, guarded by a lock."""
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Take ``cost`` tokens; returns 0 if allowed, else the seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+# Same algorithm as LocalLimiter.take, run atomically inside Redis with its
+# clock, so workers on different hosts agree.
+_REDIS_TAKE = '''
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+'''
+
+
+class RedisLimiter:
+    """Buckets in Redis, shared by every worker process."""
+
+    def __init__(self, url, prefix='couplecenter:ratelimit:'):
+        self._redis = redisclient.client(url)
+        self._take = self._redis.register_script(_REDIS_TAKE)
+        self.prefix = prefix
+
+    def take(self, key, rate, burst, cost=1):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst, cost]))
+
+
+def make_limiter(url=None):
+    """LocalLimiter by default; a RedisLimiter when given a ``redis://`` URL."""
+    if url:
+        return RedisLimiter(url)
+    return LocalLimiter()
+
+
+def _subject():
+    couple_id = session.get('couple_id')
+    return f'couple:{couple_id}' if couple_id else f'addr:{request.remote_addr}'
+
+
+def check(name, cost=1):
+    """Take from the current couple's ``name`` bucket; raises TooManyRequests when empty."""
+    if not current_app.config['RATELIMIT_ENABLED']:
+        return
+    state = current_app.extensions['ratelimit']
+    rate, burst = state['limits'][name]
+    wait = state['limiter'].take(f'{name}:{_subject()}', rate, burst, cost)
+    if wait:
+        raise TooManyRequests(retry_after=math.ceil(wait))
+
+
+def limit(name, methods=('POST',), json=False):
+    """Apply the ``name`` limit to this view's requests with one of ``methods``.
+
+    Views under /api/ answer a limited request with JSON; ``json=True`` does
+    the same for a JSON endpoint elsewhere.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in methods:
+                try:
+                    check(name)
+                except TooManyRequests as e:
+                    if json:
+                        return json_error(e)
+                    raise
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def json_error(e):
+    response = jsonify(error='Too many requests, slow down.', retry_after=e.retry_after)
+    response.status_code = 429
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def too_many_requests(e):
+    # API clients get JSON; pages get werkzeug's plain error page. Both carry
+    # Retry-After.
+    if not request.path.startswith('/api/'):
+        return e
+    return json_error(e)
+
+
+def init_app(app):
+    app.config.setdefault('RATELIMIT_ENABLED', os.getenv('RATELIMIT_ENABLED', '1') == '1')
+    app.config.setdefault('RATELIMIT_URL', redisclient.setting_url('RATELIMIT_URL'))
+    app.config.setdefault('RATE_LIMITS', {})
+    app.extensions['ratelimit'] = {
+        'limiter': make_limiter(app.config['RATELIMIT_URL']),
+        'limits': {**LIMITS, **app.config['RATE_LIMITS']},
+    }
+    app.register_error_handler(TooManyRequests, too_many_requests)
@@ -0,0 +1,26 @@
+"""The Redis connection shared by the caches, the pub/sub hub and the rate limiter.
+
+Each of them works in-process by default and through Redis when its setting
+(CACHE_URL, PUBSUB_URL, RATELIMIT_URL) names a server. REDIS_URL sets all
+three at once. Modules given the same URL share one client and with it one
+connection pool.
+"""
+import os
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def setting_url(name):
+    """The Redis URL in setting ``name``, else REDIS_URL; None when neither is set."""
+    return os.getenv(name) or os.getenv('REDIS_URL')
+
+
+def client(url):
+    """The shared client for ``url``, created on first use."""
+    with _lock:
+        if url not in _clients:
+            import redis  # optional dependency, only needed for multi-process setups
+            _clients[url] = redis.Redis.from_url(url)
+        return _clients[url]
@@ -0,0 +1,99 @@
+"""Full-text search over Words Together messages and gallery notes.
+
+words_fts and images_fts are FTS5 indexes over words.text and images.note
+(see migrations._search_index). Triggers on the base tables keep them in
+step with every insert, edit and delete, including the partner-removal
+purge, so the write path needs no extra work.
+
+Each index also holds couple_id as a column of its own. A query is always
+``couple_id : "<id>" AND text : (...)``, which FTS5 answers by intersecting
+posting lists, so it stays fast however many couples share the database.
+Ranking is bm25 on the text column, among the newest CANDIDATES matches.
+"""
+import re
+import unicodedata
+
+from markupsafe import Markup, escape
+
+import db
+
+# kind -> (index, base table, indexed column, columns returned)
+INDEXES = {
+    'words': ('words_fts', 'words', 'text', 'w.id, w.text, w.sender_email'),
+    'images': ('images_fts', 'images', 'note', 'w.id, w.filename, w.note, w.content_hash, w.derivatives_ready'),
+}
+MAX_TERMS = 16
+# Only the newest matches are ranked: scoring every hit of a common word in a
+# long history would cost far more than the first pages are worth.
+CANDIDATES = 1000
+_WORD = re.compile(r'\w+')
+
+
+def terms(text):
+    return _WORD.findall(text)[:MAX_TERMS]
+
+
+def match_expression(couple_id, words, column):
+    """Build an FTS5 query for ``words`` scoped to one couple.
+
+    Every word must match; the last one also matches as a prefix so results
+    show up while typing. Words are quoted, so AND/OR/NEAR typed by a user
+    are searched for rather than parsed.
+    """
+    phrases = [f'"{word}"' for word in words]
+    phrases[-1] += '*'
+    return f'couple_id : "{int(couple_id)}" AND {column} : ({" ".join(phrases)})'
+
+
+def search(couple_id, text, kind='words', limit=20, offset=0):
+    """Best matches among the newest CANDIDATES hits, best first.
+
+    Returns (rows, highlights); a highlight is the matched text as escaped
+    HTML with the hits wrapped in <mark>.
+    """
+    index, table, column, columns = INDEXES[kind]
+    words = terms(text)
+    if not words or offset >= CANDIDATES:
+        return [], []
+    rows = db.query(f'''
+        SELECT {columns}, w.{column} FROM (
+            SELECT rowid, rank FROM {index} WHERE {index} MATCH ? ORDER BY rowid DESC LIMIT {CANDIDATES}
+        ) AS hit JOIN {table} AS w ON w.id = hit.rowid
+        ORDER BY hit.rank, w.id DESC
+        LIMIT ? OFFSET ?
+    ''', (match_expression(couple_id, words, column), min(limit, CANDIDATES - offset), offset))
+    return [row[:-1] for row in rows], [highlight(row[-1], words) for row in rows]
+
+
+def _fold(word):
+    # Same matching rules as the index: case and diacritics are ignored.
+    return ''.join(c for c in unicodedata.normalize('NFKD', word) if not unicodedata.combining(c)).casefold()
+
+
+def highlight(text, words):
+    """Escape ``text`` as HTML and wrap the words that matched in <mark>."""
+    whole = {_fold(word) for word in words}
+    prefix = _fold(words[-1])
+    parts, end = [], 0
+    text = text or ''
+    for match in _WORD.finditer(text):
+        parts.append(escape(text[end:match.start()]))
+        folded = _fold(match.group())
+        if folded in whole or folded.startswith(prefix):
+            parts.append(Markup('<mark>{}</mark>').format(match.group()))
+        else:
+            parts.append(escape(match.group()))
+        end = match.end()
+    parts.append(escape(text[end:]))
+    return str(Markup('').join(parts))
+
+
+def rebuild():
+    """Re-index every row, e.g. after restoring a database copied in from elsewhere."""
+    with db.transaction() as conn:
+        for index, _, _, _ in INDEXES.values():
+            conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+    with db.connection() as conn:
+        for index, _, _, _ in INDEXES.values():
+            conn.execute(f"INSERT INTO {index} ({index}) VALUES ('optimize')")
+            conn.commit()
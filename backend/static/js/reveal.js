@@ -0,0 +1,21 @@
+// Fade elements marked data-reveal up into place the first time they scroll
+// into view; data-reveal-delay staggers them (ms). Styles are in style.css.
+document.addEventListener('DOMContentLoaded', function () {
+    var items = document.querySelectorAll('[data-reveal]');
+    items.forEach(function (item) {
+        item.style.transitionDelay = (item.dataset.revealDelay || 0) + 'ms';
+    });
+    if (!('IntersectionObserver' in window)) {
+        items.forEach(function (item) { item.classList.add('revealed'); });
+        return;
+    }
+    var observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                entry.target.classList.add('revealed');
+                observer.unobserve(entry.target);
+            }
+        });
+    }, { rootMargin: '0px 0px -10% 0px' });
+    items.forEach(function (item) { observer.observe(item); });
+});
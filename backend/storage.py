@@ -0,0 +1,189 @@
+"""Where uploaded photos, their derivatives and invitation cards are kept.
+
+Files are addressed by name (``ab/cd/abcd....jpg``, see media.py) and go
+through one of two backends with the same methods:
+
+LocalStorage
+    A directory, UPLOAD_FOLDER by default. Names are sharded by content
+    hash, so directories stay small even with millions of files, and files
+    are staged in UPLOAD_FOLDER/tmp (same filesystem) and renamed into
+    place, so a reader never sees half of one. /media serves them after its access check,
+    directly or through the proxy (MEDIA_ACCEL_PREFIX).
+
+S3Storage
+    A bucket on S3 or anything speaking its API (MinIO, R2, ...), chosen
+    with STORAGE_URL=s3://bucket/optional/prefix; S3_ENDPOINT_URL points at
+    a non-AWS endpoint and credentials come from the usual AWS_* variables.
+    Files are sent with multipart uploads, and /media answers with a
+    redirect to a short-lived presigned URL, so image bytes never pass
+    through the app.
+
+Work that needs a real file (Pillow, hashing) happens in a staging file from
+staged(); put() then moves it into the store.
+"""
+import mimetypes
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from flask import current_app
+
+URL_EXPIRES = int(os.getenv('MEDIA_URL_EXPIRES', '3600'))  # seconds a presigned URL stays valid
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+SPOOL_BYTES = 8 * 1024 * 1024  # files read back from S3 stay in memory up to this size
+STORED_CACHE_CONTROL = 'private, max-age=31536000, immutable'  # stored names never change content
+
+
+class LocalStorage:
+    """Files in a directory on this host."""
+
+    def __init__(self, root):
+        self.root = root
+        self.staging_dir = os.path.join(root, 'tmp')
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def put(self, name, staged_path):
+        """Move the file at ``staged_path`` (from staged()) to ``name``."""
+        dest = self.path(name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(staged_path, dest)
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def url(self, name, expires=URL_EXPIRES):
+        return None  # served by the app, see main.media_file
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket."""
+
+    staging_dir = None  # the system temp directory
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, client=None):
+        import boto3  # optional dependency, only needed for the S3 backend
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self._client = client or boto3.client(
+            's3', endpoint_url=endpoint_url,
+            # MinIO and most stand-ins only do path-style addressing.
+            config=Config(signature_version='s3v4', s3={'addressing_style': 'path' if endpoint_url else 'auto'}),
+        )
+        self._transfer = TransferConfig(
+            multipart_threshold=MULTIPART_CHUNK_SIZE, multipart_chunksize=MULTIPART_CHUNK_SIZE
+        )
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def put(self, name, staged_path):
+        """Upload the file at ``staged_path`` to ``name`` and remove it."""
+        with open(staged_path, 'rb') as f:
+            self._client.upload_fileobj(f, self.bucket, self._key(name), Config=self._transfer, ExtraArgs={
+                'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                'CacheControl': STORED_CACHE_CONTROL,
+            })
+        os.remove(staged_path)
+
+    def open(self, name):
+        # Pillow and zipfile want a seekable file; small objects stay in memory.
+        f = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        try:
+            self._client.download_fileobj(self.bucket, self._key(name), f)
+        except self._client.exceptions.ClientError as e:
+            f.close()
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(name) from e
+            raise
+        f.seek(0)
+        return f
+
+    def exists(self, name):
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except self._client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def delete(self, name):
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def url(self, name, expires=URL_EXPIRES):
+        return self._client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._key(name)}, ExpiresIn=expires
+        )
+
+
+@contextmanager
+def staged(store, suffix=''):
+    """Yield a path for a file about to be put() into ``store``; removed if it is not."""
+    if store.staging_dir:
+        os.makedirs(store.staging_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=store.staging_dir, suffix=suffix)
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def copy_tree(root, store):
+    """Copy the files under directory ``root`` into ``store``; returns how many were copied.
+
+    For moving an existing UPLOAD_FOLDER to a bucket. Files the store already
+    has are skipped, so it can be run again after an interruption.
+    """
+    copied = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root and 'tmp' in dirnames:
+            dirnames.remove('tmp')  # staging files
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, '/')
+            if store.exists(name):
+                continue
+            with staged(store) as path:
+                shutil.copyfile(os.path.join(dirpath, filename), path)
+                store.put(name, path)
+            copied += 1
+    return copied
+
+
+def make_storage(url=None, root=None, endpoint_url=None):
+    """LocalStorage under ``root`` by default; S3Storage for an ``s3://bucket/prefix`` URL."""
+    if url and url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        return S3Storage(bucket, prefix, endpoint_url=endpoint_url)
+    if url:
+        raise ValueError(f'Unsupported STORAGE_URL {url!r}; expected s3://bucket/prefix.')
+    return LocalStorage(root)
+
+
+def current():
+    """The store of the running app."""
+    return current_app.extensions['storage']
+
+
+def init_app(app):
+    app.config.setdefault('STORAGE_URL', os.getenv('STORAGE_URL'))
+    app.config.setdefault('S3_ENDPOINT_URL', os.getenv('S3_ENDPOINT_URL'))
+    app.extensions['storage'] = make_storage(
+        app.config['STORAGE_URL'], app.config['UPLOAD_FOLDER'], app.config['S3_ENDPOINT_URL']
+    )
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A migrated database in a temporary directory, used by every db helper."""
+    previous = db.DATABASE_PATH
+    path = str(tmp_path / 'test.db')
+    db.configure(path)
+    migrations.migrate()
+    db.execute("INSERT INTO couples (id, user1_email, user2_email) VALUES (1, 'a@example.com', 'b@example.com')")
+    yield path
+    db.configure(previous)
@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+
+import pytest
+from flask import Flask
+
+import db
+import quotas
+import writes
+
+
+@pytest.fixture
+def committer(database):
+    committer = writes.GroupCommitter(max_delay=0)
+    yield committer
+    committer._discard_connection()
+
+
+def commit(committer, *writes_):
+    """Apply ``writes_`` as one batch on the calling thread; returns their futures."""
+    batch = [(write, Future()) for write in writes_]
+    committer._commit(batch)
+    return [future for _, future in batch]
+
+
+def add_word(text):
+    def write(conn):
+        return conn.execute(
+            "INSERT INTO words (couple_id, text, sender_email) VALUES (1, ?, 'a@example.com')", (text,)
+        ).lastrowid
+    return write
+
+
+def words():
+    return [row[0] for row in db.query('SELECT text FROM words ORDER BY id')]
+
+
+def test_batch_is_committed_together(committer):
+    futures = commit(committer, add_word('one'), add_word('two'), add_word('three'))
+    assert [f.result() for f in futures] == [1, 2, 3]
+    assert words() == ['one', 'two', 'three']
+
+
+def test_failing_write_is_rolled_back_alone(committer):
+    def failing(conn):
+        add_word('half done')(conn)
+        raise ValueError('boom')
+
+    first, second, third = commit(committer, add_word('one'), failing, add_word('three'))
+    assert first.result() == 1
+    with pytest.raises(ValueError, match='boom'):
+        second.result()
+    assert third.result() is not None
+    assert words() == ['one', 'three']
+
+
+def test_image_over_quota_is_rolled_back(committer):
+    def add_image(name):
+        def write(conn):
+            conn.execute("INSERT INTO images (couple_id, filename, note) VALUES (1, ?, '')", (name,))
+            quotas.check_images(conn, 1, limit=1)
+        return write
+
+    kept, rejected = commit(committer, add_image('a.jpg'), add_image('b.jpg'))
+    kept.result()
+    with pytest.raises(quotas.QuotaExceeded):
+        rejected.result()
+    assert db.query('SELECT filename FROM images') == [('a.jpg',)]
+    assert quotas.usage(1, 'images') == 1
+
+
+def test_broken_transaction_fails_the_whole_batch(committer):
+    def ends_transaction(conn):
+        conn.execute('ROLLBACK')  # the savepoint is gone, so the batch cannot go on
+
+    futures = commit(committer, add_word('one'), ends_transaction)
+    for future in futures:
+        with pytest.raises(Exception):
+            future.result()
+    assert words() == []
+    assert committer._conn is None  # reconnects for the next batch
+    commit(committer, add_word('two'))[0].result()
+    assert words() == ['two']
+
+
+def test_writer_syncs_every_commit(committer):
+    assert committer._connection().execute('PRAGMA synchronous').fetchone()[0] == 2  # FULL
+
+
+def test_run_goes_through_the_writer_thread(database):
+    assert writes.run(add_word('queued')) == 1
+    assert words() == ['queued']
+
+
+def test_run_joins_an_open_transaction(database):
+    # The writer thread would wait forever on the lock this transaction holds.
+    with Flask(__name__).app_context():
+        with db.transaction() as conn:
+            add_word('outer')(conn)
+            writes.run(add_word('inner'))
+            conn.rollback()
+        db.close_db()
+    assert words() == []
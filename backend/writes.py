@@ -0,0 +1,178 @@
+"""Group commit for the feed write paths.
+
+The pooled connections run with synchronous=NORMAL, under which a WAL
+commit is not synced at all: it survives the process crashing but not the
+machine losing power. The writer connection here uses synchronous=FULL, so
+every one of its commits syncs the log and only one connection can write at
+a time; committing every message on its own would cap throughput at the
+disk's sync rate. Writes handed to run() are instead applied by a single
+writer thread: it takes everything queued (waiting up to MAX_DELAY for more,
+at most MAX_BATCH), applies each write inside its own savepoint and commits
+them together, with one sync for the batch::
+
+    word_id = writes.run(lambda conn: conn.execute('INSERT ...', params).lastrowid)
+
+run() blocks until that commit has happened and returns the write's result,
+or raises its exception, so a caller can redirect or publish knowing the row
+is on disk and visible to its next read. A failing write is rolled back to
+its savepoint without affecting the rest of the batch.
+
+The writer has a connection of its own, outside the pool, so requests that
+hold pooled connections while they wait can never starve it. Batching is per
+process; with several gunicorn workers each has its own writer and they
+still take turns on the database lock. GROUP_COMMIT=0 runs every write in
+its own transaction in the caller's thread, as before, with the pool's
+synchronous=NORMAL.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import g, has_app_context
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('GROUP_COMMIT', '1') == '1'
+MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', '256'))
+MAX_DELAY = float(os.getenv('GROUP_COMMIT_MAX_DELAY_MS', '2')) / 1000
+
+
+class GroupCommitter:
+    """Single writer thread applying queued writes in shared transactions."""
+
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._conn = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    def submit(self, write):
+        """Queue ``write(conn)``; the returned future resolves after the commit."""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((write, future))
+        return future
+
+    def _ensure_thread(self):
+        # Started lazily and again after a fork: gunicorn workers do not
+        # inherit the master's threads.
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._conn = None
+            self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _connection(self):
+        # Follow db.configure(), e.g. when a benchmark switches databases.
+        if self._conn is None or self._path != db.DATABASE_PATH:
+            self._discard_connection()
+            self._path = db.DATABASE_PATH
+            self._conn = db.connect(self._path)
+            # A confirmed write must survive a power loss (see the module docstring).
+            self._conn.execute('PRAGMA synchronous=FULL')
+        return self._conn
+
+    def _discard_connection(self):
+        # Reconnect for the next batch rather than reuse a connection in an
+        # unknown state.
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        outcomes = []
+        try:
+            conn = self._connection()
+            # IMMEDIATE takes the write lock up front instead of upgrading
+            # from a read lock halfway through the batch.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for write, future in batch:
+                    conn.execute('SAVEPOINT write')
+                    try:
+                        result = write(conn)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO write')
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    conn.execute('RELEASE write')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        except Exception as e:
+            logger.exception('Group commit of %d write(s) failed', len(batch))
+            self._discard_connection()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        metrics.WRITE_BATCH_SIZE.observe(len(batch))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_committer = GroupCommitter()
+
+
+def configure(enabled=None, max_batch=None, max_delay=None):
+    """Change the settings read from GROUP_COMMIT* (create_app, benchmarks)."""
+    global ENABLED
+    if enabled is not None:
+        ENABLED = enabled
+    if max_batch is not None:
+        _committer.max_batch = max_batch
+    if max_delay is not None:
+        _committer.max_delay = max_delay
+
+
+def _in_transaction():
+    conn = g.get('_db_conn') if has_app_context() else None
+    return conn is not None and conn.in_transaction
+
+
+def run(write):
+    """Apply ``write(conn)`` and return its result once it is committed.
+
+    Called from inside a db.transaction() that has already written, the
+    write joins that transaction instead and is committed with it: the
+    writer thread would otherwise wait on the lock this caller holds.
+    """
+    if _in_transaction():
+        return write(db.get_db())  # committed, or rolled back, with the rest
+    if not ENABLED:
+        with db.transaction() as conn:
+            return write(conn)
+    return _committer.submit(write).result()
@@ -0,0 +1,5 @@
+"""WSGI entry point for production servers: ``gunicorn -c gunicorn.conf.py wsgi:app``."""
+from main import create_app, jobs  # main first: it loads .env for every module
+
+app = create_app()
+jobs.start_for(app)